@@ -1,4 +1,5 @@
 import asyncio
+import os
 import websockets
 import json
 from datetime import datetime
@@ -42,9 +43,13 @@ async def websocket_server():
         await asyncio.Future()  # 运行服务直到被取消
 
 # WebSocket 客户端
-async def websocket_client():
-    uri = "ws://118.190.243.214:10145/connect/json/2B9E69D98E034A0B806CA60402EE60CD"
+# uri 默认取环境变量 MARKET_WS_URI，可指向回放服务器（kline/replay.py）离线压测
+# recorder 为 replay.Recorder 时录制收发的所有帧
+async def websocket_client(uri=None, recorder=None):
+    uri = uri or os.environ.get("MARKET_WS_URI", "ws://118.190.243.214:10145/connect/json/2B9E69D98E034A0B806CA60402EE60CD")
     async with websockets.connect(uri) as connection:
+        if recorder is not None:
+            connection = recorder.wrap(connection)
         await connection.send("/fields/FS,S1,S1V,B1,B1V,O,YC,NV,H,L,ZF,P,Tick,M,S,C")
         await connection.send("/subrout/CNCF")
         await connection.send("/sub/HKEXHHI2009,HKEXHSI2009,HKEXMHI2009,NYMEXCL2011,COMEXGC2012,COMEXSI2012,COMEXHG2012,NYMEXNG2011,CBOTYM2011,CMENQ2012,CMEES2012,CMEAD2012,CMEGBP2012,CMECD2012,CMEEC,EUREXDAX2012,SGXCN2009,CFFEXIF2010,CFFEXIH2010,CFFEXIC2010")
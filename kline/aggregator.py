@@ -0,0 +1,125 @@
+import threading
+import time
+
+
+class KlineAggregator:
+    def __init__(self, ks, prex='trade', interval=1.0, flush_on_close=True, limit=None):
+        # 在内存中合并报价，只把有变化的头部 K线定期写回 Redis
+        # ks: KlineService 实例，复用其周期定义和 K线合并逻辑
+        # limit 为 None 时使用 ks 的保留策略
+        self.ks = ks
+        self.prex = prex
+        self.interval = interval
+        self.flush_on_close = flush_on_close
+        self.limit = limit
+
+        self.bars = {}      # (code, cycle) -> 当前未收盘的 K线
+        self.closed = {}    # (code, cycle) -> 尚未写回的已收盘 K线（按时间升序）
+        self.stored = {}    # (code, cycle) -> Redis 列表头部 K线的 ctm
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.thread = None
+        self.running = False
+
+    def key(self, code, cycle):
+        return f"{self.prex}_kline_{code}_{cycle}"
+
+    def load_heads(self, code):
+        # 第一次见到某个合约时读取 Redis 中各周期的头部 K线，保证续写已有数据
+        pipe = self.ks.kline_redis.pipeline(transaction=False)
+        for cycle in self.ks.cycles:
+            pipe.lindex(self.key(code, cycle), 0)
+        for cycle, head in zip(self.ks.cycles, pipe.execute()):
+            kline = self.ks.decode_kline(head) if head else None
+            self.bars[(code, cycle)] = kline
+            self.stored[(code, cycle)] = kline.get('ctm') if kline else None
+
+    def apply(self, ticket, is_ask=True):
+        # 合并一笔报价，按需触发写回
+        code = ticket['code']
+        price = self.ks.get_price(ticket, is_ask)
+        has_closed = False
+        with self.lock:
+            if (code, next(iter(self.ks.cycles))) not in self.bars:
+                self.load_heads(code)
+            heads = {cycle: self.bars.get((code, cycle)) for cycle in self.ks.cycles}
+            for cycle, kline, is_new in self.ks.merge_ticket(heads, ticket, price):
+                bar_key = (code, cycle)
+                last = heads[cycle]
+                if is_new and last:
+                    self.closed.setdefault(bar_key, []).append(last)
+                    has_closed = True
+                self.bars[bar_key] = kline
+                self.dirty.add(bar_key)
+
+        if (has_closed and self.flush_on_close) or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        # 把所有有变化的 K线用一个事务写回 Redis，返回写回的列表数
+        # 事务成功后才清除待写回的数据，写回失败时全部保留，下次重试
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.dirty:
+                return 0
+
+            pipe = self.ks.kline_redis.pipeline(transaction=True)
+            stored_after = {}
+            for bar_key in self.dirty:
+                key = self.key(*bar_key)
+                stored = self.stored.get(bar_key)
+                limit = self.limit or self.ks.retention.limit(*bar_key)
+                for kline in self.closed.get(bar_key, []) + [self.bars[bar_key]]:
+                    if kline['ctm'] == stored:
+                        pipe.lset(key, 0, self.ks.encode_kline(kline))
+                    else:
+                        pipe.lpush(key, self.ks.encode_kline(kline))
+                        stored = kline['ctm']
+                    if self.ks.indexed:
+                        self.ks.queue_index(pipe, f"{self.prex}_kindex_{bar_key[0]}_{bar_key[1]}", kline, limit)
+                    if self.ks.indicators:
+                        self.ks.queue_indicators(pipe, self.prex, *bar_key, kline, limit)
+                stored_after[bar_key] = stored
+                pipe.ltrim(key, 0, limit - 1)
+                pipe.hincrby(f"{self.prex}_kline_version", key, 1)
+            try:
+                pipe.execute()
+            except Exception:
+                if self.ks.indicators:
+                    # 指标状态已按失败的事务更新过，重新从 Redis 回填
+                    for bar_key in self.dirty:
+                        self.ks.indicators.discard(self.prex, *bar_key)
+                raise
+            count = len(self.dirty)
+            closed, self.closed = self.closed, {}
+            self.dirty = set()
+            self.stored.update(stored_after)
+            if self.ks.history:
+                for (code, cycle), klines in closed.items():
+                    self.ks.history.append(self.prex, code, cycle, klines)
+            return count
+
+    def start(self):
+        # 启动后台线程，按 interval 定期写回
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"K线写回失败: {e}")
+
+    def stop(self):
+        # 停止后台线程并写回剩余数据
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
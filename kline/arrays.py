@@ -0,0 +1,62 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from .codec import KLINE_FIELDS, KLINE_STRUCT, decode_kline, to_float
+except ImportError:
+    from codec import KLINE_FIELDS, KLINE_STRUCT, decode_kline, to_float
+
+# 导出的数值列，ctm 为 int64，其余为 float64
+ARRAY_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("K线列数组导出需要安装 numpy")
+
+
+def packed_dtype():
+    # 与 codec.KLINE_STRUCT 相同布局的结构化 dtype
+    return np.dtype([('fmt', 'u1'), ('ctm', '<i8')] + [(field, '<f8') for field in KLINE_FIELDS])
+
+
+def raws_to_arrays(raws):
+    # Redis 列表（时间降序）转换为按时间升序的连续列数组 {'ctm': ..., 'open': ..., ...}
+    require_numpy()
+    raws = raws[::-1]
+    if raws and all(isinstance(raw, bytes) and len(raw) == KLINE_STRUCT.size and raw[:1] != b'{' for raw in raws):
+        # 紧凑编码直接按结构化 dtype 解析，不经过 Python 循环
+        records = np.frombuffer(b''.join(raws), dtype=packed_dtype())
+        arrays = {'ctm': records['ctm'].astype(np.int64)}
+        arrays.update({field: np.ascontiguousarray(records[field]) for field in ARRAY_FIELDS})
+        return arrays
+    bars = [decode_kline(raw) for raw in raws]
+    arrays = {'ctm': np.array([int(bar['ctm']) for bar in bars], dtype=np.int64)}
+    for field in ARRAY_FIELDS:
+        arrays[field] = np.array([to_float(bar.get(field)) for bar in bars], dtype=np.float64)
+    return arrays
+
+
+def extend_arrays(older, arrays):
+    # 把更早的列数组（如本地历史）接在升序列数组前面
+    if not len(older['ctm']):
+        return arrays
+    extended = {'ctm': np.concatenate([older['ctm'].astype(np.int64), arrays['ctm']])}
+    extended.update({field: np.concatenate([older[field], arrays[field]]) for field in ARRAY_FIELDS})
+    return extended
+
+
+def align_arrays(arrays_by_code, codes):
+    # 按 ctm 对齐多个合约，返回 (ctm, {字段: 二维数组[合约, 时间]})，缺失为 NaN
+    require_numpy()
+    ctms = [arrays_by_code[code]['ctm'] for code in codes]
+    ctm = np.unique(np.concatenate(ctms)) if ctms else np.empty(0, dtype=np.int64)
+    blocks = {field: np.full((len(codes), len(ctm)), np.nan) for field in ARRAY_FIELDS}
+    for row, code in enumerate(codes):
+        arrays = arrays_by_code[code]
+        columns = np.searchsorted(ctm, arrays['ctm'])
+        for field in ARRAY_FIELDS:
+            blocks[field][row, columns] = arrays[field]
+    return ctm, blocks
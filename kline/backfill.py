@@ -0,0 +1,162 @@
+import asyncio
+import random
+import time
+
+try:
+    from .upstream import KLINE_HOST, AsyncFetcher
+except ImportError:
+    from upstream import KLINE_HOST, AsyncFetcher
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        # 令牌桶限速：平均每秒 rate 个请求，允许 burst 个突发
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        # 只在同一个事件循环中使用，检查和扣减之间没有 await，不需要加锁
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BackfillPipeline:
+    def __init__(self, ks, prex='tf_futures_trade', concurrency=32, rate=50, burst=None, retries=3, backoff=0.5,
+                 batch_size=50, flush_interval=0.5, report_interval=5.0, host=KLINE_HOST, merge=True):
+        # 有界的异步 K线回填流水线：
+        # 获取阶段最多 concurrency 个并发请求，令牌桶限速，失败按指数退避加随机抖动重试 retries 次
+        # 写入阶段单独一个任务，每 batch_size 个 K线列表（或每 flush_interval 秒）写一批
+        # merge=True 时只写入新增或变化的 K线（merge_klines），否则整体替换（queue_save_klines）
+        self.ks = ks
+        self.prex = prex
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self.host = host
+        self.merge = merge
+        self.metrics = {}
+
+    def reset_metrics(self, total):
+        self.metrics = {'total': total, 'fetched': 0, 'written': 0, 'unchanged': 0, 'failed': 0, 'retries': 0,
+                        'bars': 0, 'batches': 0, 'started': time.monotonic(), 'seconds': 0.0, 'failures': []}
+
+    def progress(self):
+        # 当前进度和吞吐量的一行摘要
+        m = self.metrics
+        seconds = time.monotonic() - m['started']
+        return (f"回填进度 {m['written'] + m['failed']}/{m['total']}，写入 {m['written']}，失败 {m['failed']}，"
+                f"重试 {m['retries']}，{m['bars']} 条 K线，{m['written'] / seconds if seconds else 0:.1f} 个/秒")
+
+    async def fetch(self, fetcher, symbol, minutes):
+        # 获取一个 K线列表，空响应或解析失败同样重试，重试用尽后抛出最后一次的异常
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            try:
+                klines = await fetcher.fetch_kline(symbol, minutes, self.host)
+                if klines:
+                    return klines
+                error = ValueError("响应为空或无法解析")
+            except Exception as e:
+                error = e
+            if attempt < self.retries:
+                self.metrics['retries'] += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        raise error
+
+    async def fetch_worker(self, fetcher, jobs, results):
+        while True:
+            try:
+                symbol, minutes = jobs.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                klines = await self.fetch(fetcher, symbol, minutes)
+                self.metrics['fetched'] += 1
+                await results.put((symbol, minutes, klines))
+            except Exception as e:
+                self.metrics['failed'] += 1
+                self.metrics['failures'].append((symbol, minutes, repr(e)))
+
+    def write_batch(self, batch):
+        # 在线程池中执行，一个流水线写入整批 K线列表
+        if self.merge:
+            stats = self.ks.merge_klines([(symbol, minutes, klines) for symbol, minutes, klines in batch], self.prex)
+            self.metrics['unchanged'] += stats['unchanged']
+            return
+        pending = []
+        pipe = self.ks.kline_redis.pipeline(transaction=False)
+        for symbol, minutes, klines in batch:
+            self.ks.queue_save_klines(pipe, klines, self.prex, cycle=minutes, code=symbol, pending=pending)
+        pipe.execute()
+        self.ks.record_history(self.prex, pending)
+
+    async def writer(self, results):
+        # 写入阶段：攒够 batch_size 个或等待超过 flush_interval 后写一批，收到 None 时写完剩余数据退出
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            batch = []
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(results.get(), max(deadline - loop.time(), 0.001))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            if not batch:
+                continue
+            try:
+                await loop.run_in_executor(None, self.write_batch, batch)
+            except Exception as e:
+                # 写入失败不中断流水线，整批记为失败
+                self.metrics['failed'] += len(batch)
+                self.metrics['failures'].extend((symbol, minutes, repr(e)) for symbol, minutes, _ in batch)
+                continue
+            self.metrics['written'] += len(batch)
+            self.metrics['bars'] += sum(len(item[2]) for item in batch)
+            self.metrics['batches'] += 1
+
+    async def reporter(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(self.progress())
+
+    async def run_async(self, jobs):
+        jobs = list(jobs)
+        self.reset_metrics(len(jobs))
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        # 写入跟不上时获取阶段在 put 处等待，内存中最多积压几批数据
+        results = asyncio.Queue(maxsize=self.batch_size * 4)
+        writer = asyncio.create_task(self.writer(results))
+        reporter = asyncio.create_task(self.reporter()) if self.report_interval else None
+        async with AsyncFetcher(limit=self.concurrency, limit_per_host=self.concurrency) as fetcher:
+            await asyncio.gather(*[self.fetch_worker(fetcher, queue, results)
+                                   for _ in range(min(self.concurrency, len(jobs)))])
+        await results.put(None)
+        await writer
+        if reporter:
+            reporter.cancel()
+        self.metrics['seconds'] = time.monotonic() - self.metrics['started']
+        print(self.progress())
+        return self.metrics
+
+    def run(self, jobs):
+        # 回填 [(symbol, minutes)]，返回统计信息
+        return asyncio.run(self.run_async(jobs))
@@ -0,0 +1,657 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import requests
+
+import upstream
+
+from aggregator import KlineAggregator
+from backfill import BackfillPipeline
+from codec import decode_kline, encode_kline
+from indicators import IndicatorEngine
+from fetchqueue import KlineFetchWorkers, KlineRequestQueue
+from kliner import KlineService
+from poller import QuotePoller
+from quotes import parse_quotes
+from retention import RetentionPolicy
+from replay import Recorder, ReplayServer
+from snapshot import KlineSnapshot
+
+
+def make_ticket(code='BENCH0', ts=None, price=4800.0):
+    # 构造一条测试报价
+    ts = int(ts or time.time())
+    return {
+        "ask": price,
+        "bid": price - 2,
+        "price": price,
+        "wave": 0.5,
+        "volume": 1000.0,
+        "digit": 4,
+        "code": code,
+        "code2": code,
+        "ctm": f"{ts}",
+        "ctmfmt": datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def stand_in_kline(ts, bars=240):
+    # 替身服务器返回的分钟 K线 JSONP，按整分钟对齐
+    ts -= ts % 60
+    items = [{"d": datetime.fromtimestamp(ts - (bars - i) * 60).strftime('%Y-%m-%d %H:%M:%S'),
+              "o": "4800.000", "h": "4810.000", "l": "4790.000", "c": "4805.000", "v": "1200"} for i in range(bars)]
+    return f"/*<script>location.href='//sina.com';</script>*/\nvar _x=({json.dumps(items)});"
+
+
+def stand_in_quote(symbol, ts, price=4800.0):
+    # 替身服务器返回的单个合约报价行，字段顺序与新浪商品期货相同
+    clock = datetime.fromtimestamp(ts)
+    fields = [symbol, clock.strftime('%H%M%S'), f"{price:.3f}", f"{price + 20:.3f}", f"{price - 20:.3f}",
+              f"{price:.3f}", f"{price - 2:.3f}", f"{price + 2:.3f}", f"{price:.3f}", f"{price:.3f}",
+              f"{price - 10:.3f}", "92", "133", "1346345.000", "455290", "郑", "PTA", clock.strftime('%Y-%m-%d'), "1"]
+    return f'var hq_str_nf_{symbol}="{",".join(fields)},,,,,,,,,{price:.3f},{price:.3f}";'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # 本地替身行情服务器：K线接口和报价接口，latency 秒（另加每个合约 per_symbol 秒）后返回，fail 中的合约返回 500
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    per_symbol = 0.0
+    fail = set()
+    hits = 0
+
+    def do_GET(self):
+        StandInHandler.hits += 1
+        path = unquote(self.path)
+        if 'getFewMinLine' in path:
+            symbols = [path.split('symbol=')[-1].split('&')[0]]
+        else:
+            symbols = [x[3:] for x in path.split('list=')[-1].split(',') if x.startswith('nf_')]
+        time.sleep(self.latency + self.per_symbol * len(symbols))
+        if self.fail & set(symbols):
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if 'getFewMinLine' in path:
+            body = stand_in_kline(int(time.time()))
+        else:
+            body = "\n".join(stand_in_quote(symbol, int(time.time())) for symbol in symbols)
+        data = body.encode('gbk')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/javascript; charset=GBK')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stand_in(latency=0.0, per_symbol=0.0):
+    # 在后台线程启动替身服务器，返回 (server, 'http://127.0.0.1:端口')
+    StandInHandler.latency = latency
+    StandInHandler.per_symbol = per_symbol
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def timeit(name, func, count):
+    start = time.perf_counter()
+    func()
+    cost = time.perf_counter() - start
+    print(f"{name}: {count} 次, 耗时 {cost:.3f}s, {count / cost:.0f} 次/秒")
+    return cost
+
+
+def legacy_save_kline(ks, ticket, prex='bench', is_ask=True):
+    # 改为流水线之前的写法（修正了分桶和删除重复 K线的错误），作为对比基线：
+    # 每个周期依次 LRANGE、LSET/LPUSH、LRANGE、LLEN、LTRIM，每条命令一次往返
+    price = ks.get_price(ticket, is_ask)
+    for cycle, this_ctm, this_ctmfmt in ks.get_buckets(ticket):
+        key = f"{prex}_kline_{ticket['code']}_{cycle}"
+        head = ks.redis.lrange(key, 0, 0)
+        kline, is_new = ks.merge_kline(json.loads(head[0]) if head else None, ticket, price, this_ctm, this_ctmfmt)
+        if is_new:
+            ks.redis.lpush(key, json.dumps(kline))
+        else:
+            ks.redis.lset(key, 0, json.dumps(kline))
+            second = ks.redis.lrange(key, 1, 1)
+            if second and json.loads(second[0]).get('ctm') == this_ctm:
+                ks.redis.lset(key, 1, '__removed__')
+                ks.redis.lrem(key, 1, '__removed__')
+        if ks.redis.llen(key) > 500:
+            ks.redis.ltrim(key, 0, 499)
+
+
+def count_requests(client, func):
+    # 统计 func 执行期间发往 Redis 的请求数（一个流水线或事务算一次），即真实网络下的往返次数
+    cls = client.connection_pool.connection_class
+    send = cls.send_packed_command
+    count = [0]
+
+    def counted(self, *args, **kwargs):
+        count[0] += 1
+        return send(self, *args, **kwargs)
+
+    cls.send_packed_command = counted
+    try:
+        func()
+    finally:
+        cls.send_packed_command = send
+    return count[0]
+
+
+def bench_save_kline(ks, count=2000, prex='bench'):
+    # 每笔报价写入所有周期的 K线：逐条命令（基线）、WATCH + 流水线 + 事务、Lua 脚本三种写法对比
+    # 本地内存中的 Redis 没有网络延迟，实际耗时差距主要来自往返次数，一并打印每笔报价的往返次数
+    ts = int(time.time())
+    tickets = [make_ticket(ts=ts + i, price=4800.0 + i % 7) for i in range(count)]
+    atomic = ks.atomic
+    results = {}
+    try:
+        for name, mode in (('逐条命令', None), ('流水线', False), ('Lua 脚本', True)):
+            for key in ks.redis.scan_iter(f"{prex}_*"):
+                ks.redis.delete(key)
+            ks.atomic = mode
+            save = (lambda ticket: legacy_save_kline(ks, ticket, prex)) if mode is None else \
+                (lambda ticket: ks.save_kline(ticket, prex))
+            save(tickets[0])
+
+            def run():
+                for ticket in tickets[1:]:
+                    save(ticket)
+
+            requests_count = count_requests(ks.redis, lambda: timeit(f"save_kline {name}", run, count - 1))
+            print(f"  每笔报价 {requests_count / (count - 1):.1f} 次往返")
+            results[name] = {cycle: ks.load_kline('BENCH0', cycle, prex, decode=True) for cycle in ks.cycles}
+    finally:
+        ks.atomic = atomic
+    assert results['逐条命令'] == results['流水线'] == results['Lua 脚本'], '三种写法的 K线不一致'
+    for key in ks.redis.scan_iter(f"{prex}_*"):
+        ks.redis.delete(key)
+
+
+def bench_save_kline_atomic(ks, count=2000, prex='bench'):
+    # 与 save_kline 相同的报价，改用 Lua 脚本写入
+    atomic = ks.atomic
+    ks.atomic = True
+    try:
+        ts = int(time.time())
+
+        def run():
+            for i in range(count):
+                ks.save_kline(make_ticket(ts=ts + i, price=4800.0 + i % 7), prex)
+
+        timeit('save_kline_atomic', run, count)
+    finally:
+        ks.atomic = atomic
+    for key in ks.redis.scan_iter(f"{prex}_*"):
+        ks.redis.delete(key)
+
+
+def bench_cache(ks, count=3000, limit=50, prex='bench'):
+    # 边写入边读取：load_kline_cached 与 load_kline(decode=True) 的结果必须一致，并对比读取耗时
+    # 保留条数设得很小，使列表频繁被裁剪；普通、紧凑编码、Lua、时间索引四种写入方式各跑一遍
+    ts = int(time.time()) // 86400 * 86400
+    cycles = ['1分钟', '5分钟', '1小时']
+    for mode in ({}, {'packed': True}, {'atomic': True}, {'indexed': True}):
+        service = KlineService(cycles=cycles, retention=RetentionPolicy(default=limit), **mode)
+        mismatches = 0
+        for i in range(count):
+            # 每笔间隔 10 到 70 秒，1 分钟线大部分报价都会换线
+            service.save_kline(make_ticket(ts=ts + i * 10 + (i * 7919) % 60, price=4800.0 + i % 13), prex)
+            for cycle in cycles:
+                if service.load_kline_cached('BENCH0', cycle, prex) != service.load_kline('BENCH0', cycle, prex,
+                                                                                         decode=True):
+                    mismatches += 1
+        stats = service.kline_cache.stats()
+        print(f"cache {mode or '普通'}: {count * len(cycles)} 次读取，不一致 {mismatches}，"
+              f"命中 {stats['hits']}，修补 {stats['partial']}，未命中 {stats['misses']}")
+        assert mismatches == 0
+        for key in ks.redis.scan_iter(f"{prex}_*"):
+            ks.redis.delete(key)
+
+    for i in range(500):
+        ks.save_kline(make_ticket(ts=ts + i * 60), prex)
+    timeit('load_kline decode', lambda: [ks.load_kline('BENCH0', '1分钟', prex, decode=True)
+                                         for _ in range(count)], count)
+    timeit('load_kline_cached', lambda: [ks.load_kline_cached('BENCH0', '1分钟', prex) for _ in range(count)], count)
+    for key in ks.redis.scan_iter(f"{prex}_*"):
+        ks.redis.delete(key)
+
+
+def bench_aggregator(ks, count=2000, prex='bench'):
+    # 报价先在内存中合并，按收盘和时间间隔写回
+    aggregator = KlineAggregator(ks, prex)
+    ts = int(time.time())
+
+    def run():
+        for i in range(count):
+            aggregator.apply(make_ticket(ts=ts + i, price=4800.0 + i % 7))
+        aggregator.flush()
+
+    timeit('aggregator', run, count)
+    for key in ks.redis.scan_iter(f"{prex}_*"):
+        ks.redis.delete(key)
+
+
+def bench_save_tickets(ks, count=20, codes=665, prex='bench'):
+    # 整个市场快照：逐条 save_ticket 与一次 save_tickets 对比
+    ts = int(time.time())
+    snapshot = [make_ticket(code=f"BENCH{i}", ts=ts) for i in range(codes)]
+
+    def run_single():
+        for _ in range(count):
+            ks.reset_ticket_cache(prex)
+            for ticket in snapshot:
+                ks.save_ticket(ticket, prex)
+
+    def run_batch():
+        for _ in range(count):
+            ks.reset_ticket_cache(prex)
+            ks.save_tickets(snapshot, prex)
+
+    def run_unchanged():
+        # 休市时行情不变，指纹缓存命中后不访问 Redis
+        for _ in range(count):
+            ks.save_tickets(snapshot, prex)
+
+    timeit('save_ticket x 665', run_single, count)
+    timeit('save_tickets', run_batch, count)
+    timeit('save_tickets 无变化', run_unchanged, count)
+    ks.redis.delete(f"{prex}_ticket")
+
+
+def bench_bucketing(ks, count=20000):
+    # get_key + strptime 与整数时间戳分桶对比，不需要 Redis
+    ts = int(time.time())
+    tickets = [make_ticket(ts=ts + i * 7) for i in range(count)]
+
+    def run_get_key():
+        for ticket in tickets:
+            for m in ks.cycles.values():
+                ks.parse_key(ks.get_key(m, ticket['ctmfmt']))
+
+    def run_bucketer():
+        for ticket in tickets:
+            ks.get_buckets(ticket)
+
+    def run_bucket_many():
+        timestamps = [ticket['ctm'] for ticket in tickets]
+        for m in ks.cycles.values():
+            ks.bucketer.bucket_many(m, timestamps)
+
+    timeit('get_key', run_get_key, count)
+    timeit('bucket_all', run_bucketer, count)
+    timeit('bucket_many', run_bucket_many, count)
+
+
+def bench_encoding(ks, count=100000):
+    # JSON 与紧凑编码的体积和编解码耗时，不需要 Redis
+    ts = int(time.time())
+    bars = [ks.merge_kline(None, ticket, ticket['price'], ctm, ctmfmt)[0]
+            for ticket in [make_ticket(ts=ts, price=4800.5)]
+            for _, ctm, ctmfmt in ks.get_buckets(ticket)]
+    bars = (bars * (count // len(bars) + 1))[:count]
+    for packed in (False, True):
+        name = 'packed' if packed else 'json'
+        encoded = []
+        timeit(f'{name} encode', lambda: encoded.extend(encode_kline(bar, packed) for bar in bars), count)
+        timeit(f'{name} decode', lambda: [decode_kline(raw) for raw in encoded], count)
+        size = sum(len(raw) for raw in encoded) / count
+        print(f"{name}: 平均每条 {size:.1f} 字节, 665 合约 x 12 周期 x 500 条约 {size * 665 * 12 * 500 / 2 ** 20:.0f} MB")
+
+
+def bench_cascade(ks, count=50000):
+    # 逐周期合并与级联合并对比，并校验两者 OHLCV 完全一致，不需要 Redis
+    ts = int(time.time())
+    tickets = [make_ticket(ts=ts + i * 13, price=4800.0 + (i * 7919) % 61) for i in range(count)]
+    results = {}
+    for cascade in (False, True):
+        name = 'cascade' if cascade else 'per-cycle'
+        ks.cascade, heads, history = cascade, {}, {}
+
+        def run():
+            for ticket in tickets:
+                for cycle, kline, is_new in ks.merge_ticket(heads, ticket, ticket['ask']):
+                    if is_new:
+                        history.setdefault(cycle, []).append(kline)
+                    heads[cycle] = kline
+
+        timeit(name, run, count)
+        results[cascade] = history
+    ks.cascade = False
+    assert results[False] == results[True], 'cascade 与逐周期合并结果不一致'
+    print('cascade 与逐周期合并结果一致')
+
+
+def bench_resample(ks, minutes=1000, prex='bench'):
+    # 由 1 分钟 K线重采样出 5 分钟、1 小时、2 小时，与逐笔维护的同周期列表逐根核对
+    # 1 分钟列表只保留 500 条，第一条落在 2 小时周期中间：没有历史时不返回不完整的第一根，有历史时从历史补全
+    cycles = {'5': '5分钟', '60': '1小时', '2h': '2小时'}
+    ts = 1729548540 - 1000 * 60 + 60
+    for history in (None, tempfile.mkdtemp()):
+        service = KlineService(cycles=['1分钟'] + list(cycles.values()), history=history)
+        for i in range(minutes * 3):
+            service.save_kline(make_ticket(ts=ts + i * 20, price=4800.0 + (i * 7919) % 61), prex)
+        first = int(service.load_kline_arrays('BENCH0', '1分钟', prex)['ctm'][0])
+        for timeframe, cycle in cycles.items():
+            arrays = service.load_kline_resampled('BENCH0', timeframe, prex)
+            stored = {int(kline['ctm']): kline for kline in service.load_kline('BENCH0', cycle, prex, decode=True)}
+            for index, ctm in enumerate(arrays['ctm'].tolist()):
+                kline = stored[ctm]
+                assert [arrays[field][index] for field in ('open', 'high', 'low', 'close')] == \
+                       [float(kline[field]) for field in ('open', 'high', 'low', 'close')], (timeframe, ctm)
+            assert history or arrays['ctm'][0] >= first
+        timeit(f"resample {'有历史' if history else '无历史'}",
+               lambda: [service.load_kline_resampled('BENCH0', '2h', prex) for _ in range(100)], 100)
+        for key in ks.redis.scan_iter(f"{prex}_*"):
+            ks.redis.delete(key)
+        if history:
+            shutil.rmtree(history)
+    print('resample 与逐笔维护的 K线一致')
+
+
+def bench_indicators(ks, count=5000, bars=500):
+    # 每笔报价增量更新指标，对比每次用 500 条 K线重新批量计算，并核对两者结果
+    closes = [4800 + (i * 37) % 101 - 50 for i in range(bars)]
+    ctm = list(range(0, bars * 60, 60))
+    engine = IndicatorEngine()
+    rows = engine.backfill('bench', 'BENCH0', '1分钟', ctm, closes)
+
+    def incremental():
+        for i in range(count):
+            engine.update('bench', 'BENCH0', '1分钟', ctm[-1], closes[-1] + i % 7)
+
+    def recompute():
+        for i in range(count // 50):
+            IndicatorEngine().backfill('bench', 'BENCH0', '1分钟', ctm, closes[:-1] + [closes[-1] + i % 7])
+
+    timeit('indicators incremental', incremental, count)
+    timeit('indicators recompute', recompute, count // 50)
+
+    replay = IndicatorEngine()
+    for t, close in zip(ctm, closes):
+        values = replay.update('bench', 'BENCH0', '1分钟', t, close)[0]
+    assert all(abs((values[field] or 0) - (rows[-1][field] or 0)) < 1e-6 for field in values), '增量与批量计算结果不一致'
+    print('增量与批量计算结果一致')
+
+
+def bench_snapshot(ks, codes=665, bars=500, prex='bench', path='bench.snap'):
+    # 导出并导入 codes 个合约所有周期各 bars 条 K线和报价哈希，核对导入结果
+    ts = int(time.time())
+    pipe = ks.kline_redis.pipeline(transaction=False)
+    for i in range(codes):
+        ticket = make_ticket(f'BENCH{i}', ts)
+        pipe.hset(f"{prex}_ticket", ticket['code'], json.dumps(ticket))
+        for cycle in ks.cycles:
+            klines = [dict(ticket, ctm=ts - j * 60, open=4800.0, high=4800.0, low=4800.0, close=4800.0)
+                      for j in range(bars)]
+            pipe.delete(f"{prex}_kline_{ticket['code']}_{cycle}")
+            pipe.rpush(f"{prex}_kline_{ticket['code']}_{cycle}", *[ks.encode_kline(kline) for kline in klines])
+        pipe.execute()
+    head = ks.raw_redis.lrange(f"{prex}_kline_BENCH0_1分钟", 0, -1)
+
+    snapshot = KlineSnapshot(ks)
+    print('dump:', snapshot.dump(path, [prex]))
+    ks.kline_redis.delete(*[f"{prex}_kline_BENCH{i}_{cycle}" for i in range(codes) for cycle in ks.cycles])
+    print('restore:', snapshot.restore(path))
+    assert ks.raw_redis.lrange(f"{prex}_kline_BENCH0_1分钟", 0, -1) == head, '导入结果与导出前不一致'
+    os.remove(path)
+
+
+def bench_upstream(ks, count=400, latency=0.01, workers=16):
+    # 对本地替身服务器获取分钟 K线：每次新建连接、共享连接池、异步客户端
+    server, host = start_stand_in(latency)
+    symbols = [f'BENCH{i}' for i in range(count)]
+
+    def no_session():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda symbol: upstream.parse_kline(requests.get(
+                upstream.kline_url(symbol, '1', host), headers=upstream.kline_headers(symbol)).text), symbols))
+
+    def pooled():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda symbol: upstream.fetch_kline(symbol, '1', host), symbols))
+
+    async def fetch_async():
+        async with upstream.AsyncFetcher(limit=workers, limit_per_host=workers) as fetcher:
+            results = await fetcher.fetch_klines([(symbol, '1') for symbol in symbols], host)
+        assert all(isinstance(result, list) and len(result) == 240 for result in results), '异步获取结果不完整'
+
+    timeit('upstream 无连接池', no_session, count)
+    timeit('upstream 共享连接池', pooled, count)
+    timeit('upstream 异步客户端', lambda: asyncio.run(fetch_async()), count)
+    server.shutdown()
+
+
+def bench_backfill(ks, codes=200, latency=0.01, prex='bench'):
+    # 对本地替身服务器回填 codes 个合约的 1 分钟和 60 分钟 K线，其中两个合约始终失败
+    server, host = start_stand_in(latency)
+    StandInHandler.fail = {'BENCH0', 'BENCH1'}
+    pipeline = BackfillPipeline(ks, prex=prex, concurrency=32, rate=1000, backoff=0.01, host=host)
+    jobs = [(f'BENCH{i}', minutes) for i in range(codes) for minutes in ('1', '60')]
+    timeit('backfill', lambda: pipeline.run(jobs), len(jobs))
+    metrics = pipeline.metrics
+    StandInHandler.fail = set()
+    server.shutdown()
+    assert metrics['failed'] == 4 and metrics['written'] == len(jobs) - 4, '回填结果与预期不符'
+    assert ks.kline_redis.llen(f"{prex}_kline_BENCH2_60") == 240
+    print(f"写入 {metrics['written']} 个列表，{metrics['batches']} 批，重试 {metrics['retries']} 次")
+
+    # 再次回填时增量合并，没有新 K线的列表不产生写入
+    server, host = start_stand_in(latency)
+    pipeline.host = host
+    timeit('backfill 增量合并', lambda: pipeline.run(jobs), len(jobs))
+    server.shutdown()
+    print(f"未变化 {pipeline.metrics['unchanged']} 个列表")
+
+
+def legacy_parse_quotes(unclean_futures, all_futures):
+    # 原 get_all_ticket 的解析方式：每个合约都重新切分整个响应，按位置对应合约
+    return_data = []
+    for i in range(len(all_futures)):
+        clean_futures = unclean_futures.split("\nvar")[i].split('"')[1].split(",")
+        try:
+            timer_date = unclean_futures.split("\nvar")[i].split('"')[1].split(",,,,,,,,,")[0].split(",")[-2]
+            timer_time = clean_futures[1]
+            fmt_time = f"{timer_date} {timer_time[0:2]}:{timer_time[2:4]}:{timer_time[4:6]}"
+            timestamp = int(time.mktime(datetime.strptime(fmt_time, "%Y-%m-%d %H:%M:%S").timetuple()))
+            return_data.append({
+                "ask": float(clean_futures[6]), "asm": float(clean_futures[12]),
+                "bid": float(clean_futures[7]), "bim": float(clean_futures[11]),
+                "open": float(clean_futures[2]), "close": float(clean_futures[10]),
+                "nv": float(clean_futures[14]), "high": float(clean_futures[3]), "low": float(clean_futures[4]),
+                "wave": float(str(round(((float(clean_futures[8]) - float(clean_futures[10])) / float(clean_futures[10])) * 100, 2))),
+                "price": float(clean_futures[8]), "volume": float(clean_futures[14]),
+                "position": float(clean_futures[9]), "digit": 4,
+                "code": all_futures[i], "code2": all_futures[i], "ctm": f"{timestamp}", "ctmfmt": fmt_time
+            })
+        except:
+            pass
+    return return_data
+
+
+def bench_quotes(ks, count=50, path=None):
+    # 解析一次全市场报价响应：原逐合约切分方式与单次扫描解析器对比
+    # path 为录制的 hq.sinajs.cn 响应文件（GBK 编码）时使用录制数据，否则用替身报价生成
+    with open(os.path.join(os.path.dirname(__file__), "futures.json"), "r", encoding="utf-8") as file:
+        symbols = [item['symbol'] for item in json.load(file) if item['exchange'] != 'cffex']
+    if path:
+        with open(path, 'r', encoding='gbk') as file:
+            text = file.read()
+    else:
+        ts = int(time.time())
+        text = "\n".join(stand_in_quote(symbol, ts, 4800.0 + i) for i, symbol in enumerate(symbols))
+
+    timeit('quotes 原解析', lambda: [legacy_parse_quotes(text, symbols) for _ in range(count)], count)
+    timeit('quotes 单次扫描', lambda: [parse_quotes(text, symbols) for _ in range(count)], count)
+    tickets, errors = parse_quotes(text, symbols)
+    print(f"{len(tickets)} 个报价，{len(errors)} 行无法解析")
+    if not path:
+        assert tickets == legacy_parse_quotes(text, symbols), '解析结果与原解析不一致'
+        # 空报价、字段缺失和缺少的合约都应报告出来
+        broken = text.replace(f'nf_{symbols[1]}="', f'nf_{symbols[1]}="x,').replace(
+            stand_in_quote(symbols[2], ts, 4802.0), f'var hq_str_nf_{symbols[2]}="";')
+        tickets, errors = parse_quotes(broken + '\nvar hq_str_nf_UNKNOWN="";', symbols + ['MISSING'])
+        assert [symbol for symbol, _ in errors] == [symbols[1], symbols[2], 'MISSING'], errors
+        print('解析结果与原解析一致，错误行:', errors)
+
+
+def bench_poller(ks, count=20, latency=0.02, per_symbol=0.0002):
+    # 对替身服务器轮询全市场报价：一个大请求与分片并发请求对比，并检查单个分片失败时其余分片正常返回
+    with open(os.path.join(os.path.dirname(__file__), "futures.json"), "r", encoding="utf-8") as file:
+        symbols = [item['symbol'] for item in json.load(file) if item['exchange'] != 'cffex']
+    server, host = start_stand_in(latency, per_symbol)
+    single = QuotePoller(symbols, shard_size=len(symbols), workers=1, host=host)
+    sharded = QuotePoller(symbols, shard_size=100, workers=8, host=host)
+    timeit('poller 单个请求', lambda: [single.poll() for _ in range(count)], count)
+    timeit('poller 分片并发', lambda: [sharded.poll() for _ in range(count)], count)
+    tickets, errors = sharded.poll()
+    assert len(tickets) == len(symbols) and not errors, errors[:3]
+
+    StandInHandler.fail = {symbols[150]}
+    tickets, errors = sharded.poll()
+    StandInHandler.fail = set()
+    assert len(tickets) == len(symbols) - 100 and len(errors) == 100 and sharded.stats[1]['failures'] == 1
+    print(sharded.report())
+    single.close()
+    sharded.close()
+    server.shutdown()
+
+
+def bench_fetchqueue(ks, count=100, latency=0.01, prex='bench'):
+    # 通过 Redis 队列按需获取 K线：并发提交 count 个请求（一半重复），测量请求到完成通知的延迟
+    server, host = start_stand_in(latency)
+    queue = KlineRequestQueue(ks.redis, name='bench_fetch')
+    ks.redis.delete(queue.queue_key, queue.processing_key, queue.pending_key, queue.consumers_key)
+    workers = KlineFetchWorkers(ks, queue, prex=prex, workers=8,
+                                fetch=lambda code, cycle: upstream.fetch_kline(code, cycle, host))
+    workers.start()
+    StandInHandler.hits = 0
+    codes = [f'BENCH{i % (count // 2)}' for i in range(count)]
+    latencies = []
+
+    def request(code):
+        start = time.perf_counter()
+        result = queue.request(code, '1', timeout=10)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    def run():
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(request, codes))
+        assert all(result and result['status'] == 'ok' for result in results), [x for x in results if not x or x['status'] != 'ok'][:3]
+
+    timeit('fetchqueue', run, count)
+    workers.stop()
+    server.shutdown()
+    latencies.sort()
+    print(f"上游请求 {StandInHandler.hits} 次，延迟中位数 {latencies[len(latencies) // 2] * 1000:.0f}ms，"
+          f"最长 {latencies[-1] * 1000:.0f}ms")
+    assert ks.kline_redis.llen(f"{prex}_kline_BENCH0_1") == 240
+
+
+def bench_replay(ks, polls=3, frames=200, speed=20.0, path='bench.replay.gz'):
+    # 录制对替身服务器的报价轮询和 K线请求，再通过回放服务器加速回放，检查解析结果与录制时一致
+    # websocket 部分录制 frames 个帧（间隔 5ms），回放时检查帧内容和按倍速缩短后的总时长
+    import websockets
+    with open(os.path.join(os.path.dirname(__file__), "futures.json"), "r", encoding="utf-8") as file:
+        symbols = [item['symbol'] for item in json.load(file) if item['exchange'] != 'cffex']
+    server, host = start_stand_in()
+    recorder = Recorder(path)
+    session = recorder.attach(requests.Session())
+    poller = QuotePoller(symbols, host=host)
+    poller.session = session
+    recorded = []
+    for i in range(polls):
+        recorded.append(sorted(poller.poll()[0], key=lambda x: x['code']))
+        time.sleep(1)
+
+    async def fetch_klines(fetcher_host, fetcher_recorder=None):
+        async with upstream.AsyncFetcher(recorder=fetcher_recorder) as fetcher:
+            return await fetcher.fetch_klines([(symbol, '1') for symbol in symbols[:50]], fetcher_host)
+
+    klines = asyncio.run(fetch_klines(host, recorder))
+    for i in range(frames):
+        recorder.record_ws('recv', json.dumps(make_ticket(f'BENCH{i}')))
+        time.sleep(0.005)
+    recorder.close()
+    server.shutdown()
+    print(f"replay 录制 {recorder.count} 条，文件 {os.path.getsize(path) / 1024:.0f}KB")
+
+    replay = ReplayServer(path, speed=speed).start()
+    poller.session = requests.Session()
+    poller.host = replay.http_url
+    replayed = [sorted(poller.poll()[0], key=lambda x: x['code'])]
+    assert replayed[0] == recorded[0]
+    assert asyncio.run(fetch_klines(replay.http_url)) == klines
+    timeit('replay 报价', lambda: [poller.poll() for _ in range(20)], 20)
+    # 回放时间越过最后一次录制后返回最后一次的响应
+    time.sleep(polls / speed + 0.1)
+    assert sorted(poller.poll()[0], key=lambda x: x['code']) == recorded[-1]
+
+    async def receive():
+        received = []
+        echo = Recorder(path + '.echo')
+        async with websockets.connect(replay.ws_url) as connection:
+            connection = echo.wrap(connection)
+            await connection.send('/sub/BENCH')
+            start = time.perf_counter()
+            for _ in range(frames):
+                received.append(await connection.recv())
+            cost = time.perf_counter() - start
+        echo.close()
+        return received, cost, echo.count
+
+    received, cost, echoed = asyncio.run(receive())
+    assert [json.loads(x)['code'] for x in received] == [f'BENCH{i}' for i in range(frames)]
+    assert echoed == frames + 1
+    print(f"replay websocket {frames} 帧，{speed:.0f} 倍速回放耗时 {cost:.3f}s，录制耗时约 {frames * 0.005:.3f}s")
+    assert cost < frames * 0.005
+    assert replay.stats['misses'] == 0, replay.stats
+    poller.close()
+    replay.stop()
+    os.remove(path)
+    os.remove(path + '.echo')
+
+
+BENCHMARKS = {
+    'save_kline': bench_save_kline,
+    'save_kline_atomic': bench_save_kline_atomic,
+    'cache': bench_cache,
+    'aggregator': bench_aggregator,
+    'save_tickets': bench_save_tickets,
+    'bucketing': bench_bucketing,
+    'encoding': bench_encoding,
+    'cascade': bench_cascade,
+    'resample': bench_resample,
+    'indicators': bench_indicators,
+    'snapshot': bench_snapshot,
+    'upstream': bench_upstream,
+    'backfill': bench_backfill,
+    'quotes': bench_quotes,
+    'poller': bench_poller,
+    'fetchqueue': bench_fetchqueue,
+    'replay': bench_replay,
+}
+
+
+if __name__ == '__main__':
+    # 用法: python benchmark.py [名称 ...]，需要本地 Redis
+    ks = KlineService()
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name](ks)
@@ -0,0 +1,88 @@
+from datetime import date, datetime, timezone
+from functools import lru_cache
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def local_offset():
+    # 本机时区相对 UTC 的秒数，与 get_key 使用的本地时间保持一致
+    # 按固定偏移计算，要求时区没有夏令时（如 Asia/Shanghai）
+    return int(datetime.now().astimezone().utcoffset().total_seconds())
+
+
+@lru_cache(maxsize=4096)
+def format_ctm(ctm, offset, fmt='%Y-%m-%d %H:%M'):
+    # K线时间戳转换为本地时间字符串
+    return datetime.fromtimestamp(ctm + offset, timezone.utc).strftime(fmt)
+
+
+class Bucketer:
+    def __init__(self, cycles, offset=None):
+        # 基于十位数时间戳的 K线分桶，结果与 KlineService.get_key 相同
+        self.cycles = cycles
+        self.offset = local_offset() if offset is None else offset
+        self.calendar = {}  # 天序号 -> (月初天序号, 年初天序号)
+
+    def month_year(self, day):
+        if day not in self.calendar:
+            d = date.fromordinal(day + EPOCH_ORDINAL)
+            self.calendar[day] = (day - d.day + 1, date(d.year, 1, 1).toordinal() - EPOCH_ORDINAL)
+        return self.calendar[day]
+
+    def bucket(self, m, ts):
+        # 返回时间戳 ts 所在 m 周期 K线的开始时间戳，不支持的周期返回 None
+        off = self.offset
+        wall = int(ts) + off
+        if isinstance(m, int):
+            if m < 60:  # 分钟：在小时内按 m 分钟取整
+                step = m * MINUTE
+                hour_start = wall - wall % HOUR
+                return hour_start + (wall - hour_start) // step * step - off
+            if m == 60:
+                return wall - wall % HOUR - off
+            if (24 * 60) % m:
+                return None
+            step = m * MINUTE  # 小时：在天内按 m 分钟取整
+            day_start = wall - wall % DAY
+            return day_start + (wall - day_start) // step * step - off
+
+        day = wall // DAY
+        if m == 'day':
+            return day * DAY - off
+        if m == 'week':
+            return (day - (day + 3) % 7) * DAY - off  # 1970-01-01 是星期四
+        if m == 'month':
+            return self.month_year(day)[0] * DAY - off
+        if m == 'year':
+            return self.month_year(day)[1] * DAY - off
+        return None
+
+    def bucket_many(self, m, timestamps):
+        # 批量分桶，分钟和小时周期直接用整数运算
+        off = self.offset
+        if isinstance(m, int) and m < 60:
+            step = m * MINUTE
+            return [t - (t + off) % HOUR % step for t in map(int, timestamps)]
+        if m == 60 or m == 'day':
+            step = HOUR if m == 60 else DAY
+            return [t - (t + off) % step for t in map(int, timestamps)]
+        if isinstance(m, int) and not (24 * 60) % m:
+            step = m * MINUTE
+            return [t - (t + off) % DAY % step for t in map(int, timestamps)]
+        return [self.bucket(m, t) for t in timestamps]
+
+    def format(self, m, ctm):
+        # 与 get_key 相同：分钟和小时周期带时分，其余只有日期
+        return format_ctm(ctm, self.offset, '%Y-%m-%d %H:%M' if isinstance(m, int) else '%Y-%m-%d')
+
+    def bucket_all(self, ts):
+        # 一次计算所有周期，返回 [(周期名, ctm, ctmfmt)]
+        result = []
+        for cycle, m in self.cycles.items():
+            ctm = self.bucket(m, ts)
+            if ctm is not None:
+                result.append((cycle, ctm, self.format(m, ctm)))
+        return result
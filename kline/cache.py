@@ -0,0 +1,47 @@
+from collections import OrderedDict
+
+
+class KlineCache:
+    def __init__(self, size=256):
+        # 已解码 K线列表的 LRU 缓存，键为 (prex, code, cycle)
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.partial = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def patch(self, bars, head, size):
+        # 用最新的头部两条 K线修补缓存，结果最多保留 size 条（Redis 中列表的长度）
+        # 无法确定只有头部变化时返回 None
+        if not bars or not head:
+            return None
+        if head[0].get('ctm') == bars[0].get('ctm'):
+            return (head[:1] + bars[1:])[:size]
+        if len(head) > 1 and head[1].get('ctm') == bars[0].get('ctm'):
+            return (head + bars[1:])[:size]
+        return None
+
+    def stats(self):
+        total = self.hits + self.partial + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'partial': self.partial,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.partial) / total if total else 0,
+        }
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,45 @@
+import json
+import math
+import struct
+
+try:
+    from .bucketing import format_ctm, local_offset
+except ImportError:
+    from bucketing import format_ctm, local_offset
+
+# 紧凑 K线编码：1 字节 ctmfmt 格式 + ctm(int64) + 7 个 float64，共 65 字节
+KLINE_FIELDS = ('open', 'high', 'low', 'close', 'wave', 'volume', 'price')
+KLINE_STRUCT = struct.Struct('<Bq7d')
+CTMFMT_FORMATS = {
+    1: '%Y-%m-%d %H:%M',
+    2: '%Y-%m-%d',
+    3: '%Y-%m-%d %H:%M:%S',
+}
+CTMFMT_LENGTHS = {16: 1, 10: 2, 19: 3}
+OFFSET = local_offset()
+
+
+def to_float(value):
+    # None 和空字符串编码为 NaN
+    if value is None or value == '':
+        return math.nan
+    return float(value)
+
+
+def encode_kline(kline, packed=False):
+    # 编码单条 K线，packed=False 时与原来的 JSON 格式相同
+    if not packed:
+        return json.dumps(kline)
+    fmt = CTMFMT_LENGTHS.get(len(kline.get('ctmfmt') or ''), 1)
+    return KLINE_STRUCT.pack(fmt, int(kline['ctm']), *[to_float(kline.get(field)) for field in KLINE_FIELDS])
+
+
+def decode_kline(raw):
+    # 解码单条 K线，兼容 JSON 和紧凑编码
+    if isinstance(raw, str) or raw[:1] == b'{':
+        return json.loads(raw)
+    fmt, ctm, *values = KLINE_STRUCT.unpack(raw)
+    kline = {field: None if math.isnan(value) else value for field, value in zip(KLINE_FIELDS, values)}
+    kline['ctm'] = ctm
+    kline['ctmfmt'] = format_ctm(ctm, OFFSET, CTMFMT_FORMATS[fmt])
+    return kline
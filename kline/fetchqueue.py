@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+try:
+    from .upstream import KLINE_MINUTES, fetch_kline
+except ImportError:
+    from upstream import KLINE_MINUTES, fetch_kline
+
+# 提交协议（其他语言的程序可直接按此提交，不需要本模块）：
+# 成员为 "{code}|{cycle}"，如 "rb2501|1"，cycle 为 1、10、15、30、45、60
+# 用下面的 SUBMIT_LUA 提交：EVAL <脚本> 2 kline_fetch_pending kline_fetch_queue 成员
+# 即在一个脚本中 SADD kline_fetch_pending 成员，返回 1 时再 RPUSH kline_fetch_queue 成员
+# （两条命令分开执行时，中间崩溃会留下永远不会处理的请求）
+# 返回 0 表示相同请求已在排队或处理中，不需要重复提交
+# 需要等待结果时先 SUBSCRIBE kline_fetch_done 再提交，完成后该频道发布
+#     {"code", "cycle", "status": "ok"/"error", "bars", "stats" 或 "error"}
+# 旧的 is_search_{code}_{cycle} 键仍由 migrate_search_keys 定期转换为请求（见 test.py）
+
+# 请求未在队列或处理中时才入队，返回 1 表示新入队
+SUBMIT_LUA = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+class KlineRequestQueue:
+    def __init__(self, client, name='kline_fetch', consumer=None, lease=30):
+        # 按需获取 K线的请求队列，成员为 "code|cycle"
+        # {name}_queue: 待处理列表
+        # {name}_processing:{consumer}: 每个进程自己的处理中列表，consumer 默认为 主机名:进程号:随机串
+        # {name}_consumers: consumer -> 最近一次心跳时间，超过 lease 秒没有心跳的进程视为已退出，
+        #   recover 把它的处理中列表放回队列，不会抢走仍在运行的进程正在处理的请求
+        # {name}_pending: 排队或处理中的请求集合，用于去重；完成后在 {name}_done 频道发布结果
+        self.redis = client
+        self.name = name
+        self.consumer = consumer or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease = lease
+        self.queue_key = f"{name}_queue"
+        self.processing_key = f"{name}_processing:{self.consumer}"
+        self.consumers_key = f"{name}_consumers"
+        self.pending_key = f"{name}_pending"
+        self.channel = f"{name}_done"
+        self.submit_script = client.register_script(SUBMIT_LUA)
+
+    def submit(self, code, cycle):
+        # 提交请求，相同的 (code, cycle) 已在排队或处理中时不重复入队，返回是否新入队
+        return bool(self.submit_script(keys=[self.pending_key, self.queue_key], args=[f"{code}|{cycle}"]))
+
+    def take(self, timeout=1):
+        # 阻塞取出一个请求并移入处理中列表，超时返回 None
+        member = self.redis.blmove(self.queue_key, self.processing_key, timeout, 'LEFT', 'RIGHT')
+        if member is None:
+            return None
+        member = member.decode() if isinstance(member, bytes) else member
+        code, _, cycle = member.partition('|')
+        return code, cycle
+
+    def complete(self, code, cycle, result):
+        # 标记请求完成并通知所有等待该 (code, cycle) 的请求方
+        member = f"{code}|{cycle}"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrem(self.processing_key, 1, member)
+        pipe.srem(self.pending_key, member)
+        pipe.publish(self.channel, json.dumps(dict(result, code=code, cycle=cycle)))
+        pipe.execute()
+
+    def heartbeat(self):
+        # 登记本进程仍在处理请求，需要在 lease 秒内重复调用
+        self.redis.hset(self.consumers_key, self.consumer, time.time())
+
+    def requeue(self, key):
+        # 把一个处理中列表的请求逐条移回队列头部，返回移回的个数
+        count = 0
+        while self.redis.lmove(key, self.queue_key, 'RIGHT', 'LEFT') is not None:
+            count += 1
+        return count
+
+    def recover(self):
+        # 把心跳超时的进程（以及旧版本共用的 {name}_processing 列表）正在处理的请求放回队列，返回放回的个数
+        deadline = time.time() - self.lease
+        count = self.requeue(f"{self.name}_processing")
+        for consumer, beat in self.redis.hgetall(self.consumers_key).items():
+            consumer = consumer.decode() if isinstance(consumer, bytes) else consumer
+            if consumer != self.consumer and float(beat) < deadline:
+                count += self.requeue(f"{self.name}_processing:{consumer}")
+                self.redis.hdel(self.consumers_key, consumer)
+        return count
+
+    def close(self):
+        # 正常退出时放回自己未处理完的请求并注销
+        self.requeue(self.processing_key)
+        self.redis.hdel(self.consumers_key, self.consumer)
+
+    def request(self, code, cycle, timeout=10):
+        # 提交请求并等待完成，返回结果字典，超时返回 None
+        # 先订阅再提交，不会错过在两者之间完成的通知
+        code, cycle = str(code), str(cycle)
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        try:
+            self.submit(code, cycle)
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=max(deadline - time.monotonic(), 0.001))
+                if message is None:
+                    continue
+                result = json.loads(message['data'])
+                if result['code'] == code and result['cycle'] == cycle:
+                    return result
+            return None
+        finally:
+            pubsub.close()
+
+    def migrate_search_keys(self, ks):
+        # 把旧的 is_search_{code}_{cycle} 键转换为队列请求并删除，返回转换的个数
+        # 兼容仍在写这种键的程序，需要定期调用
+        count = 0
+        for key in ks.match_search_keys():
+            parts = key.split("_")
+            if len(parts) >= 4:
+                self.submit(parts[2], parts[3])
+                count += 1
+            ks.redis.delete(key)
+        return count
+
+
+class KlineFetchWorkers:
+    def __init__(self, ks, queue, prex='tf_futures_trade', workers=8, fetch=fetch_kline):
+        # workers 个线程阻塞等待请求，获取 K线后增量合并写入 Redis 并发布完成通知
+        self.ks = ks
+        self.queue = queue
+        self.prex = prex
+        self.workers = workers
+        self.fetch = fetch
+        self.threads = []
+        self.running = False
+        self.lock = threading.Lock()
+        self.last_beat = 0
+        self.metrics = {'served': 0, 'failed': 0, 'seconds': 0.0}
+
+    def serve_one(self, code, cycle):
+        # 处理一个请求，返回发布给请求方的结果
+        start = time.perf_counter()
+        if cycle not in KLINE_MINUTES:
+            return {'status': 'error', 'error': f"仅支持分钟{','.join(KLINE_MINUTES)}"}
+        try:
+            klines = self.fetch(code, cycle)
+            if not klines:
+                raise ValueError("响应为空或无法解析")
+            stats = self.ks.merge_klines([(code, cycle, klines)], self.prex)
+            result = {'status': 'ok', 'bars': len(klines), 'stats': stats}
+        except Exception as e:
+            result = {'status': 'error', 'error': repr(e)}
+        with self.lock:
+            self.metrics['served' if result['status'] == 'ok' else 'failed'] += 1
+            self.metrics['seconds'] += time.perf_counter() - start
+        return result
+
+    def run(self):
+        while self.running:
+            try:
+                if time.monotonic() - self.last_beat >= self.queue.lease / 3:
+                    # 定期续约，顺便接管已退出进程留下的请求
+                    self.last_beat = time.monotonic()
+                    self.queue.heartbeat()
+                    self.queue.recover()
+                request = self.queue.take(timeout=1)
+                if request:
+                    self.queue.complete(*request, self.serve_one(*request))
+            except Exception as e:
+                print(f"K线请求处理失败: {e}")
+                time.sleep(1)
+
+    def start(self):
+        # 登记心跳并放回已退出进程未处理完的请求后启动工作线程
+        if self.running:
+            return
+        self.queue.heartbeat()
+        self.queue.recover()
+        self.last_beat = time.monotonic()
+        self.running = True
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.queue.close()
@@ -0,0 +1,84 @@
+import mmap
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from .arrays import ARRAY_FIELDS, packed_dtype, require_numpy
+    from .codec import KLINE_STRUCT, encode_kline
+except ImportError:
+    from arrays import ARRAY_FIELDS, packed_dtype, require_numpy
+    from codec import KLINE_STRUCT, encode_kline
+
+RECORD_SIZE = KLINE_STRUCT.size
+CTM_STRUCT = struct.Struct('<q')
+
+
+class HistoryStore:
+    def __init__(self, root):
+        # 本地历史 K线：每个 (prex, code, cycle) 一个只追加的定长记录文件，记录格式与紧凑编码相同
+        # 文件内按 ctm 升序，只追加比最后一条更新的已收盘 K线
+        self.root = root
+        self.last_ctm = {}
+
+    def path(self, prex, code, cycle):
+        return os.path.join(self.root, prex, str(code), f"{cycle}.bin")
+
+    def get_last_ctm(self, path):
+        # 读取文件最后一条记录的 ctm，截掉写到一半的残缺记录
+        if path not in self.last_ctm:
+            last = None
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+                if size % RECORD_SIZE:
+                    size -= size % RECORD_SIZE
+                    os.truncate(path, size)
+                if size:
+                    with open(path, 'rb') as file:
+                        file.seek(size - RECORD_SIZE + 1)
+                        last = CTM_STRUCT.unpack(file.read(CTM_STRUCT.size))[0]
+            self.last_ctm[path] = last
+        return self.last_ctm[path]
+
+    def append(self, prex, code, cycle, klines):
+        # 追加已收盘的 K线，返回实际写入的条数
+        path = self.path(prex, code, cycle)
+        last = self.get_last_ctm(path)
+        records = []
+        for kline in sorted(klines, key=lambda x: int(x['ctm'])):
+            ctm = int(kline['ctm'])
+            if last is None or ctm > last:
+                records.append(encode_kline(kline, packed=True))
+                last = ctm
+        if records:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as file:
+                file.write(b''.join(records))
+            self.last_ctm[path] = last
+        return len(records)
+
+    def read(self, prex, code, cycle, start=None, end=None):
+        # 内存映射读取 start <= ctm <= end 的记录，返回结构化数组的切片（不复制数据）
+        require_numpy()
+        path = self.path(prex, code, cycle)
+        dtype = packed_dtype()
+        if not os.path.exists(path) or os.path.getsize(path) < RECORD_SIZE:
+            return np.empty(0, dtype=dtype)
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        records = np.frombuffer(buffer, dtype=dtype, count=len(buffer) // RECORD_SIZE)
+        ctm = records['ctm']
+        left = 0 if start is None else np.searchsorted(ctm, start, side='left')
+        right = len(records) if end is None else np.searchsorted(ctm, end, side='right')
+        return records[left:right]
+
+    def read_arrays(self, prex, code, cycle, start=None, end=None):
+        # 与 load_kline_arrays 相同的列数组，各列为记录文件上的视图
+        records = self.read(prex, code, cycle, start, end)
+        arrays = {'ctm': records['ctm']}
+        arrays.update({field: records[field] for field in ARRAY_FIELDS})
+        return arrays
@@ -0,0 +1,268 @@
+import math
+import re
+from collections import deque
+
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    np = None
+
+try:
+    from .arrays import require_numpy
+except ImportError:
+    from arrays import require_numpy
+
+# 默认计算的指标，MACD 为 (12, 26, 9)，BOLL 为 (20, 2)
+INDICATOR_NAMES = ('MA5', 'MA10', 'MA20', 'EMA12', 'EMA26', 'MACD', 'BOLL', 'RSI14')
+EMA_BLOCK = 64
+
+
+def ema_step(prev, value, alpha):
+    # 递推一步，prev 为 None 时以 value 作为初值
+    return value if prev is None else alpha * value + (1 - alpha) * prev
+
+
+def ema_series(values, alpha, prev=None):
+    # 向量化的 y[i] = alpha * x[i] + (1 - alpha) * y[i - 1]
+    # 按 EMA_BLOCK 分块，块内用下三角权重矩阵一次算出，避免长序列的幂次溢出
+    values = np.asarray(values, dtype=np.float64)
+    result = np.empty_like(values)
+    if not len(values):
+        return result
+    decay = 1 - alpha
+    idx = np.arange(EMA_BLOCK)
+    weights = np.tril(alpha * decay ** np.maximum(idx[:, None] - idx[None, :], 0))
+    powers = decay ** (idx + 1)
+    prev = values[0] if prev is None else prev
+    for start in range(0, len(values), EMA_BLOCK):
+        block = values[start:start + EMA_BLOCK]
+        m = len(block)
+        result[start:start + m] = weights[:m, :m] @ block + powers[:m] * prev
+        prev = result[start + m - 1]
+    return result
+
+
+def rolling(values, n):
+    # 长度为 n 的滑动窗口视图，开头不足 n 条的窗口用 NaN 补齐
+    padded = np.concatenate([np.full(n - 1, np.nan), np.asarray(values, dtype=np.float64)])
+    return sliding_window_view(padded, n)
+
+
+class MA:
+    def __init__(self, n):
+        # 简单移动平均，不足 n 条时取已有 K线的平均
+        self.n = n
+        self.name = f"MA{n}"
+        self.window = deque(maxlen=n - 1)
+        self.total = 0.0
+
+    def values(self, close):
+        return {self.name: (self.total + close) / (len(self.window) + 1)}
+
+    def commit(self, close):
+        self.window.append(close)
+        self.total = math.fsum(self.window)
+
+    def batch(self, closes):
+        if len(closes):
+            self.window.extend(closes[-(self.n - 1):] if self.n > 1 else [])
+            self.total = math.fsum(self.window)
+        return {self.name: np.nanmean(rolling(closes, self.n), axis=1) if len(closes) else np.empty(0)}
+
+
+class EMA:
+    def __init__(self, n):
+        self.name = f"EMA{n}"
+        self.alpha = 2 / (n + 1)
+        self.prev = None
+
+    def values(self, close):
+        return {self.name: ema_step(self.prev, close, self.alpha)}
+
+    def commit(self, close):
+        self.prev = ema_step(self.prev, close, self.alpha)
+
+    def batch(self, closes):
+        series = ema_series(closes, self.alpha, self.prev)
+        if len(series):
+            self.prev = float(series[-1])
+        return {self.name: series}
+
+
+class MACD:
+    def __init__(self, fast=12, slow=26, signal=9):
+        # DIF = EMA(fast) - EMA(slow)，DEA = EMA(DIF, signal)，MACD = 2 * (DIF - DEA)
+        self.alphas = (2 / (fast + 1), 2 / (slow + 1), 2 / (signal + 1))
+        self.fast = self.slow = self.dea = None
+
+    def step(self, close):
+        fast = ema_step(self.fast, close, self.alphas[0])
+        slow = ema_step(self.slow, close, self.alphas[1])
+        dea = ema_step(self.dea, fast - slow, self.alphas[2])
+        return fast, slow, dea
+
+    def values(self, close):
+        fast, slow, dea = self.step(close)
+        return {'DIF': fast - slow, 'DEA': dea, 'MACD': 2 * (fast - slow - dea)}
+
+    def commit(self, close):
+        self.fast, self.slow, self.dea = self.step(close)
+
+    def batch(self, closes):
+        fast = ema_series(closes, self.alphas[0], self.fast)
+        slow = ema_series(closes, self.alphas[1], self.slow)
+        dif = fast - slow
+        dea = ema_series(dif, self.alphas[2], self.dea)
+        if len(closes):
+            self.fast, self.slow, self.dea = float(fast[-1]), float(slow[-1]), float(dea[-1])
+        return {'DIF': dif, 'DEA': dea, 'MACD': 2 * (dif - dea)}
+
+
+class BOLL:
+    def __init__(self, n=20, width=2):
+        # 布林带，中轨为 n 条均值，标准差按总体标准差计算
+        self.n = n
+        self.width = width
+        self.window = deque(maxlen=n - 1)
+        self.total = self.squares = 0.0
+
+    def values(self, close):
+        count = len(self.window) + 1
+        mid = (self.total + close) / count
+        std = math.sqrt(max((self.squares + close * close) / count - mid * mid, 0.0))
+        return {'BOLL': mid, 'UB': mid + self.width * std, 'LB': mid - self.width * std}
+
+    def commit(self, close):
+        self.window.append(close)
+        self.total = math.fsum(self.window)
+        self.squares = math.fsum(x * x for x in self.window)
+
+    def batch(self, closes):
+        if not len(closes):
+            return {'BOLL': np.empty(0), 'UB': np.empty(0), 'LB': np.empty(0)}
+        self.window.extend(closes[-(self.n - 1):] if self.n > 1 else [])
+        self.total = math.fsum(self.window)
+        self.squares = math.fsum(x * x for x in self.window)
+        view = rolling(closes, self.n)
+        mid = np.nanmean(view, axis=1)
+        std = np.nanstd(view, axis=1)
+        return {'BOLL': mid, 'UB': mid + self.width * std, 'LB': mid - self.width * std}
+
+
+class RSI:
+    def __init__(self, n):
+        # 涨跌幅按 SMA(X, n, 1) 平滑，第一条 K线没有 RSI
+        self.name = f"RSI{n}"
+        self.alpha = 1 / n
+        self.prev_close = self.gain = self.loss = None
+
+    def step(self, close):
+        diff = close - self.prev_close
+        return ema_step(self.gain, max(diff, 0.0), self.alpha), ema_step(self.loss, max(-diff, 0.0), self.alpha)
+
+    def values(self, close):
+        if self.prev_close is None:
+            return {self.name: None}
+        gain, loss = self.step(close)
+        return {self.name: 100 * gain / (gain + loss) if gain + loss else None}
+
+    def commit(self, close):
+        if self.prev_close is not None:
+            self.gain, self.loss = self.step(close)
+        self.prev_close = close
+
+    def batch(self, closes):
+        closes = np.asarray(closes, dtype=np.float64)
+        if not len(closes):
+            return {self.name: np.empty(0)}
+        head = [] if self.prev_close is None else [self.prev_close]
+        diffs = np.diff(np.concatenate([head, closes]))
+        gain = ema_series(np.maximum(diffs, 0), self.alpha, self.gain)
+        loss = ema_series(np.maximum(-diffs, 0), self.alpha, self.loss)
+        total = gain + loss
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rsi = np.where(total > 0, 100 * gain / total, np.nan)
+        if len(diffs):
+            self.gain, self.loss = float(gain[-1]), float(loss[-1])
+        self.prev_close = float(closes[-1])
+        return {self.name: np.concatenate([[np.nan], rsi]) if not head else rsi}
+
+
+def make_indicator(name):
+    # 'MA5'、'EMA12'、'RSI14'、'MACD'、'BOLL' 或带参数的 'MACD(12,26,9)'、'BOLL(20,2)'
+    match = re.fullmatch(r'([A-Z]+)(\d*)(?:\(([\d.,\s]+)\))?', name.upper())
+    if not match:
+        raise ValueError(f"不支持的指标: {name}")
+    kind, n, params = match.groups()
+    params = [float(x) if '.' in x else int(x) for x in params.split(',')] if params else []
+    if kind in ('MA', 'EMA', 'RSI') and n:
+        return {'MA': MA, 'EMA': EMA, 'RSI': RSI}[kind](int(n))
+    if kind == 'MACD' and not n:
+        return MACD(*params)
+    if kind == 'BOLL' and not n:
+        return BOLL(*params)
+    raise ValueError(f"不支持的指标: {name}")
+
+
+class IndicatorEngine:
+    def __init__(self, names=INDICATOR_NAMES):
+        # 每个 (prex, code, cycle) 保存截至上一根已收盘 K线的指标状态
+        # 头部 K线每次更新只用当前收盘价从状态算出当前值，新 K线出现时才把上一根的收盘价计入状态
+        self.names = tuple(names)
+        for name in self.names:
+            make_indicator(name)
+        self.states = {}
+
+    def knows(self, prex, code, cycle):
+        return (prex, code, cycle) in self.states
+
+    def backfill(self, prex, code, cycle, ctm, closes):
+        # 用升序的 ctm 和收盘价数组重建状态，返回每根 K线的指标值 [{ctm, 指标: 值}]（时间升序）
+        require_numpy()
+        closes = np.asarray(closes, dtype=np.float64)
+        indicators = [make_indicator(name) for name in self.names]
+        columns = {}
+        for indicator in indicators:
+            columns.update(indicator.batch(closes[:-1]))
+        state = {'indicators': indicators, 'ctm': None, 'close': None}
+        self.states[(prex, code, cycle)] = state
+        rows = [{'ctm': int(x)} for x in ctm[:-1]]
+        for field, values in columns.items():
+            for row, value in zip(rows, values.tolist()):
+                row[field] = None if math.isnan(value) else value
+        if len(closes):
+            state['ctm'], state['close'] = int(ctm[-1]), float(closes[-1])
+            rows.append(self.current(state))
+        return rows
+
+    def current(self, state):
+        values = {'ctm': state['ctm']}
+        for indicator in state['indicators']:
+            values.update(indicator.values(state['close']))
+        return values
+
+    def update(self, prex, code, cycle, ctm, close):
+        # 合并一次头部 K线更新，返回 (当前指标值, 是否为新 K线)，比头部更早的 K线返回 None
+        state = self.states.get((prex, code, cycle))
+        if state is None:
+            state = {'indicators': [make_indicator(name) for name in self.names], 'ctm': None, 'close': None}
+            self.states[(prex, code, cycle)] = state
+        ctm = int(ctm)
+        if state['ctm'] is not None and ctm < state['ctm']:
+            return None
+        is_new = ctm != state['ctm']
+        if is_new and state['ctm'] is not None:
+            for indicator in state['indicators']:
+                indicator.commit(state['close'])
+        state['ctm'], state['close'] = ctm, float(close)
+        return self.current(state), is_new
+
+    def discard(self, prex, code, cycle):
+        # 丢弃一个列表的状态，下次更新时从 Redis 重新回填（写入事务被放弃时使用）
+        self.states.pop((prex, code, cycle), None)
+
+    def reset(self, prex=None):
+        # 清空指标状态，prex 为 None 时清空全部
+        for key in [key for key in self.states if prex is None or key[0] == prex]:
+            del self.states[key]
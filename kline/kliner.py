@@ -1,13 +1,115 @@
 import json
+import time
+import uuid
 import redis
 from datetime import datetime, timedelta
 import pytz
 
+try:
+    from .arrays import align_arrays, extend_arrays, raws_to_arrays
+    from .bucketing import Bucketer
+    from .cache import KlineCache
+    from .codec import decode_kline, encode_kline
+    from .history import HistoryStore
+    from .indicators import INDICATOR_NAMES, IndicatorEngine
+    from .resample import lookback, parse_timeframe, resample
+    from .retention import RetentionPolicy, estimate_bytes
+except ImportError:
+    from arrays import align_arrays, extend_arrays, raws_to_arrays
+    from bucketing import Bucketer
+    from cache import KlineCache
+    from codec import decode_kline, encode_kline
+    from history import HistoryStore
+    from indicators import INDICATOR_NAMES, IndicatorEngine
+    from resample import lookback, parse_timeframe, resample
+    from retention import RetentionPolicy, estimate_bytes
+
+
+# 在 Redis 端原子地合并一笔报价到所有周期的头部 K线
+# KEYS[i]: 第 i 个周期的 K线列表，indexed 时 KEYS[n + i] 为对应的按时间索引的有序集合
+# KEYS[#KEYS]: K线版本号哈希，每写一个列表版本号加一
+# 返回被新 K线取代（已收盘）的头部 K线 {i1, json1, i2, json2, ...}
+# ARGV[1]: 报价 JSON {price, tick_price, wave, volume}，ARGV[2]: indexed
+# ARGV[3i], ARGV[3i + 1], ARGV[3i + 2]: 第 i 个周期的 ctm、ctmfmt 和保留条数
+KLINE_UPSERT_LUA = """
+local tick = cjson.decode(ARGV[1])
+local indexed = ARGV[2] == '1'
+local n = (#ARGV - 2) / 3
+local price = tick['price']
+local version_key = KEYS[#KEYS]
+local closed = {}
+for i = 1, n do
+    local key = KEYS[i]
+    local ctm = tonumber(ARGV[3 * i])
+    local ctmfmt = ARGV[3 * i + 1]
+    local limit = tonumber(ARGV[3 * i + 2])
+    local head = redis.call('LINDEX', key, 0)
+    local kline = head and cjson.decode(head)
+    if kline and kline['ctm'] == ctm then
+        kline['high'] = math.max(kline['open'], kline['high'], kline['low'], kline['close'], price)
+        kline['low'] = math.min(kline['open'], kline['high'], kline['low'], kline['close'], price)
+        if kline['low'] == 0 then
+            kline['low'] = tick['tick_price']
+        end
+        kline['close'] = price
+        kline['wave'] = tick['wave']
+        kline['volume'] = tick['volume']
+        kline['price'] = tick['tick_price']
+        kline['ctmfmt'] = ctmfmt
+        redis.call('LSET', key, 0, cjson.encode(kline))
+        local second = redis.call('LINDEX', key, 1)
+        if second and cjson.decode(second)['ctm'] == ctm then
+            redis.call('LSET', key, 1, '__removed__')
+            redis.call('LREM', key, 1, '__removed__')
+        end
+    else
+        if kline then
+            table.insert(closed, i)
+            table.insert(closed, head)
+        end
+        kline = {
+            open = price, high = price, low = price, close = price,
+            wave = tick['wave'], volume = tick['volume'], price = tick['tick_price'],
+            ctm = ctm, ctmfmt = ctmfmt
+        }
+        redis.call('LPUSH', key, cjson.encode(kline))
+    end
+    redis.call('LTRIM', key, 0, limit - 1)
+    redis.call('HINCRBY', version_key, key, 1)
+    if indexed then
+        local zkey = KEYS[n + i]
+        redis.call('ZREMRANGEBYSCORE', zkey, ctm, ctm)
+        redis.call('ZADD', zkey, ctm, cjson.encode(kline))
+        redis.call('ZREMRANGEBYRANK', zkey, 0, -limit - 1)
+    end
+end
+return closed
+"""
+
+
+def range_stop(limit):
+    # 读取最新 limit 条时 LRANGE 的结束下标，负数表示全部
+    return limit - 1 if limit > 0 else -1
+
 
 class KlineService:
-    def __init__(self, host='127.0.0.1', port=6379):
+    def __init__(self, host='127.0.0.1', port=6379, atomic=False, packed=False, indexed=False, cascade=False,
+                 sessions=None, cache_size=256, cycles=None, history=None,
+                 retention=None, indicators=None):
         # 初始化 Redis 连接
         self.redis = redis.Redis(host=host, port=port, decode_responses=True)
+        # atomic=True 时 save_kline 通过 Lua 脚本在 Redis 端完成合并，可多进程并发写入
+        self.atomic = atomic
+        # packed=True 时 K线以紧凑二进制格式存储，需要不解码响应的连接
+        if packed and atomic:
+            raise ValueError("紧凑编码暂不支持 atomic 模式")
+        self.packed = packed
+        self.kline_redis = redis.Redis(host=host, port=port) if packed else self.redis
+        # 不解码响应的连接，用于快照等需要原样读写的场合
+        self.raw_redis = self.kline_redis if packed else redis.Redis(host=host, port=port)
+        # indexed=True 时每个 K线列表同时写入以 ctm 为分数的有序集合，支持按时间范围查询
+        self.indexed = indexed
+        self.kline_upsert = self.redis.register_script(KLINE_UPSERT_LUA)
 
         # K线周期定义
         self.cycles = {
@@ -24,6 +126,55 @@ class KlineService:
             '月K': 'month',
             '年K': 'year'
         }
+        # cycles 指定需要逐笔维护的周期，其余周期可用 load_kline_resampled 按需生成
+        if cycles:
+            self.cycles = {cycle: m for cycle, m in self.cycles.items() if cycle in cycles}
+        self.bucketer = Bucketer(self.cycles)
+        # sessions 为 SessionCalendar 时按交易所交易时段分桶，休市时间的报价不生成 K线
+        self.sessions = sessions
+
+        # 报价指纹缓存 (prex, code) -> (指纹, 写入时间)，价格未变化的报价不读写 Redis
+        # 超过 ticket_refresh 秒仍会重写一次，防止 Redis 被清空后长期缺数据
+        self.ticket_fields = ('price', 'ask', 'bid', 'asm', 'bim', 'volume', 'position')
+        self.ticket_refresh = 60
+        self.ticket_fingerprints = {}
+        # load_tickets 的解码缓存 (prex, code) -> (原始 JSON, 解码结果)
+        self.ticket_decoded = {}
+
+        # load_kline_cached 的进程内缓存，按 LRU 最多保存 cache_size 个 K线列表
+        self.kline_cache = KlineCache(cache_size)
+        # history 为本地历史目录（或 HistoryStore）时，已收盘的 K线追加到本地文件，不受 Redis 500 条限制
+        self.history = HistoryStore(history) if isinstance(history, str) else history
+        # 各周期 K线的保留条数，默认每个周期 500 条
+        self.retention = retention or RetentionPolicy()
+        # indicators 为指标名列表（True 为默认指标）时，写 K线的同时增量计算指标
+        # 指标值存放在与 K线列表一一对应的 {prex}_indicator_{code}_{cycle} 列表中
+        if indicators is True:
+            indicators = INDICATOR_NAMES
+        self.indicators = IndicatorEngine(indicators) if indicators else None
+        # load_kline_resampled 的源周期和结果缓存
+        self.resample_sources = {'minute': '1分钟', 'day': '日K'}
+        self.resample_cache = KlineCache(cache_size)
+
+        # cascade=True 时报价只合并进 1 分钟 K线，更高周期由下一级 K线逐级推导
+        # 每个周期的上一级必须能整除它的时间段
+        self.cascade = cascade
+        self.cascade_base = '1分钟'
+        if cascade and self.cascade_base not in self.cycles:
+            raise ValueError("级联合并需要保留 1分钟 周期")
+        self.cascade_parents = {
+            '5分钟': '1分钟',
+            '10分钟': '5分钟',
+            '15分钟': '5分钟',
+            '30分钟': '15分钟',
+            '1小时': '30分钟',
+            '2小时': '1小时',
+            '4小时': '2小时',
+            '日K': '4小时',
+            '周K': '日K',
+            '月K': '日K',
+            '年K': '月K'
+        }
 
     def save(self, ticket, prex='trade', func=None):
         # 存储票据和 K线
@@ -32,97 +183,708 @@ class KlineService:
             if self.save_ticket(ticket, prex) and callable(func):
                 func(ticket, prex)
 
-    def load_ticket(self, code=None, prex='trade'):
-        # 获取最新报价
+    def load_ticket(self, code=None, prex='trade', parsed=False):
+        # 获取最新报价，code 为空时返回整个哈希，parsed=True 时值为解码后的字典
         if code:
-            if self.redis.hexists(f"{prex}_ticket", code):
-                return json.loads(self.redis.hget(f"{prex}_ticket", code))
+            data = self.redis.hget(f"{prex}_ticket", code)
+            return json.loads(data) if data else {}
+        if parsed:
+            return self.load_tickets(prex=prex)
+        return self.redis.hgetall(f"{prex}_ticket")
+
+    def load_tickets(self, codes=None, fields=None, prex='trade'):
+        # 批量获取解码后的报价 {code: ticket}，codes 为 None 时读取全部
+        # 一次 HMGET/HGETALL，未变化的报价复用上次的解码结果（返回的字典不要修改）
+        # fields 不为空时只返回指定字段
+        if codes is None:
+            raw = self.redis.hgetall(f"{prex}_ticket")
+        else:
+            codes = list(codes)
+            raw = dict(zip(codes, self.redis.hmget(f"{prex}_ticket", codes))) if codes else {}
+        tickets = {}
+        for code, data in raw.items():
+            if data is None:
+                continue
+            cached = self.ticket_decoded.get((prex, code))
+            if cached and cached[0] == data:
+                ticket = cached[1]
+            else:
+                ticket = json.loads(data)
+                self.ticket_decoded[(prex, code)] = (data, ticket)
+            tickets[code] = {field: ticket.get(field) for field in fields} if fields else ticket
+        return tickets
+
+    def load_kline(self, code, kline_type, prex='trade', limit=None, decode=False):
+        # 获取 K线数据，decode=False 时返回 JSON 字符串，decode=True 时返回字典
+        # limit 为 None 时按保留策略读取该周期保留的全部 K线
+        limit = self.retention.limit(code, kline_type) if limit is None else limit
+        data = self.kline_redis.lrange(f"{prex}_kline_{code}_{kline_type}", 0, limit)
+        if decode:
+            return [self.decode_kline(raw) for raw in data]
+        if self.packed:
+            return [json.dumps(self.decode_kline(raw)) for raw in data]
+        return data
+
+    def load_kline_cached(self, code, kline_type, prex='trade', limit=None):
+        # 带进程内缓存的 load_kline(decode=True)
+        # 每次读取版本号、列表长度和头部两条 K线（一次往返），只有头部变化时直接修补缓存
+        # 修补后的列表不超过 Redis 中列表的长度，与裁剪后的列表保持一致
+        limit = self.retention.limit(code, kline_type) if limit is None else limit
+        key = f"{prex}_kline_{code}_{kline_type}"
+        cache_key = (prex, code, kline_type)
+        pipe = self.kline_redis.pipeline(transaction=True)
+        pipe.hget(f"{prex}_kline_version", key)
+        pipe.hget(f"{prex}_kline_epoch", key)
+        pipe.llen(key)
+        pipe.lrange(key, 0, 1)
+        version, epoch, length, head = pipe.execute()
+
+        entry = self.kline_cache.get(cache_key)
+        if entry and entry['limit'] >= limit and entry['epoch'] == epoch:
+            if entry['version'] == version:
+                self.kline_cache.hits += 1
+                return entry['bars'][:limit + 1]
+            bars = self.kline_cache.patch(entry['bars'], [self.decode_kline(raw) for raw in head],
+                                          min(entry['limit'] + 1, length))
+            if bars is not None:
+                self.kline_cache.partial += 1
+                entry['version'] = version
+                entry['bars'] = bars
+                return bars[:limit + 1]
+
+        self.kline_cache.misses += 1
+        bars = self.load_kline(code, kline_type, prex, limit, decode=True)
+        self.kline_cache.put(cache_key, {'version': version, 'epoch': epoch, 'limit': limit, 'bars': bars})
+        return list(bars)
+
+    def load_kline_arrays(self, code, kline_type, prex='trade', limit=None):
+        # 获取最新 limit 条 K线的按时间升序列数组：ctm 为 int64，open/high/low/close/volume 为 float64，需要 numpy
+        # limit 为 None 时按保留策略读取，为 -1 时读取全部
+        limit = self.retention.limit(code, kline_type) if limit is None else limit
+        if limit == 0:
+            return raws_to_arrays([])
+        return raws_to_arrays(self.kline_redis.lrange(f"{prex}_kline_{code}_{kline_type}", 0, range_stop(limit)))
+
+    def load_kline_matrix(self, codes, kline_type, prex='trade', limit=None):
+        # 一次流水线读取多个合约，按 ctm 对齐为 (ctm, {字段: 二维数组[合约, 时间]})，缺失为 NaN
+        # 每个合约最多 limit 条，limit 为 None 时按保留策略读取每个合约保留的全部 K线，为 -1 时读取全部
+        codes = list(codes)
+        if limit == 0:
+            return align_arrays({code: raws_to_arrays([]) for code in codes}, codes)
+        pipe = self.kline_redis.pipeline(transaction=False)
+        for code in codes:
+            pipe.lrange(f"{prex}_kline_{code}_{kline_type}", 0,
+                        range_stop(self.retention.limit(code, kline_type) if limit is None else limit))
+        arrays = {code: raws_to_arrays(raws) for code, raws in zip(codes, pipe.execute())}
+        return align_arrays(arrays, codes)
+
+    def load_kline_resampled(self, code, timeframe, prex='trade', limit=None, source=None):
+        # 由已存储的 K线按需重采样出任意周期，如 3、'45m'、'2h'、'2d'、'week'，返回升序列数组
+        # 分钟周期默认以 1分钟 K线为源，其余以 日K 为源；有交易时段表时按交易分钟对齐
+        # 有本地历史时从历史补读第一根 K线所在周期的前半部分，无法补全的第一根 K线不返回
+        # 结果按源列表的版本号缓存，源列表没有变化时直接返回
+        kind, _ = parse_timeframe(timeframe)
+        limit = self.retention.limit(code, str(timeframe)) if limit is None else limit
+        source = source or self.resample_sources['minute' if kind == 'minute' else 'day']
+        key = f"{prex}_kline_{code}_{source}"
+        version = self.kline_redis.hget(f"{prex}_kline_version", key)
+        cache_key = (prex, code, source, str(timeframe))
+
+        entry = self.resample_cache.get(cache_key)
+        if entry and version is not None and entry['version'] == version and entry['limit'] >= limit:
+            self.resample_cache.hits += 1
+            return {field: values[-limit:] for field, values in entry['arrays'].items()}
+
+        self.resample_cache.misses += 1
+        profile = self.sessions.symbols.get(code) if self.sessions else None
+        arrays = self.load_kline_arrays(code, source, prex, limit=-1)
+        if self.history and len(arrays['ctm']):
+            first = int(arrays['ctm'][0])
+            older = self.history.read_arrays(prex, code, source, first - lookback(timeframe), first - 1)
+            arrays = extend_arrays(older, arrays)
+        arrays = resample(arrays, timeframe, self.bucketer.offset, profile, self.bucketer)
+        arrays = {field: values[-limit:] for field, values in arrays.items()}
+        if version is not None:
+            self.resample_cache.put(cache_key, {'version': version, 'limit': limit, 'arrays': arrays})
+        return arrays
+
+    def bump_kline_version(self, key, prex='trade', replaced=False, client=None):
+        # 写入 K线列表后增加版本号，整体替换时同时增加 epoch，使缓存整体失效
+        client = client or self.kline_redis
+        if replaced:
+            client.hincrby(f"{prex}_kline_epoch", key, 1)
+        client.hincrby(f"{prex}_kline_version", key, 1)
+
+    def kline_memory_report(self, prex='trade', exact=False):
+        # 估计每个 (合约, 周期) K线列表占用的 Redis 内存，包括回填和按需获取写入的分钟周期（1、10、15 等）
+        # 返回 {(code, cycle): {'bars', 'limit', 'bytes'}}，exact=True 时使用 MEMORY USAGE
+        keys = []
+        for key in self.kline_redis.scan_iter(match=f"{prex}_kline_*", count=1000):
+            key = key.decode() if isinstance(key, bytes) else key
+            # 跳过版本号哈希（{prex}_kline_version 等）和整体替换时的临时键
+            code, _, cycle = key[len(prex) + 7:].rpartition('_')
+            if code and cycle and ':tmp:' not in key:
+                keys.append((key, code, cycle))
+        pipe = self.kline_redis.pipeline(transaction=False)
+        for key, code, cycle in keys:
+            pipe.llen(key)
+            pipe.lindex(key, 0)
+            if exact:
+                pipe.memory_usage(key)
+                if self.indexed:
+                    pipe.memory_usage(f"{prex}_kindex_{code}_{cycle}")
+        values = iter(pipe.execute())
+        report = {}
+        for key, code, cycle in keys:
+            bars, head = next(values), next(values)
+            if exact:
+                size = (next(values) or 0) + ((next(values) or 0) if self.indexed else 0)
+            else:
+                size = estimate_bytes(bars, len(head or b''), self.indexed)
+            report[(code, cycle)] = {'bars': bars, 'limit': self.retention.limit(code, cycle), 'bytes': size}
+        return report
+
+    def enforce_retention(self, prex='trade', report=None):
+        # 按保留策略和内存预算裁剪所有 K线列表，返回裁剪后的内存报告
+        report = report if report is not None else self.kline_memory_report(prex)
+        self.retention.fit(report)
+        pipe = self.kline_redis.pipeline(transaction=False)
+        for (code, cycle), item in report.items():
+            limit = self.retention.limit(code, cycle)
+            if item['bars'] > limit:
+                key = f"{prex}_kline_{code}_{cycle}"
+                pipe.ltrim(key, 0, limit - 1)
+                if self.indexed:
+                    pipe.zremrangebyrank(f"{prex}_kindex_{code}_{cycle}", 0, -limit - 1)
+                self.bump_kline_version(key, prex, replaced=True, client=pipe)
+                if self.indicators:
+                    pipe.ltrim(f"{prex}_indicator_{code}_{cycle}", 0, limit - 1)
+                item['bytes'] = item['bytes'] * limit // item['bars']
+                item['bars'] = limit
+            item['limit'] = limit
+        pipe.execute()
+        return report
+
+    def load_indicators(self, code, kline_type, prex='trade', limit=None):
+        # 获取指标值（按时间降序，与 load_kline 一一对应）
+        limit = self.retention.limit(code, kline_type) if limit is None else limit
+        data = self.kline_redis.lrange(f"{prex}_indicator_{code}_{kline_type}", 0, limit)
+        return [json.loads(item) for item in data]
+
+    def queue_indicators(self, pipe, prex, code, cycle, kline, limit=None):
+        # 用头部 K线的收盘价增量更新指标，并把写入命令加入 pipe
+        # 进程内第一次遇到该列表时先用 Redis 中已有的 K线回填
+        if not self.indicators.knows(prex, code, cycle):
+            arrays = self.load_kline_arrays(code, cycle, prex, limit=-1)
+            self.queue_indicator_backfill(pipe, prex, code, cycle, arrays['ctm'], arrays['close'])
+        result = self.indicators.update(prex, code, cycle, kline['ctm'], kline['close'])
+        if result is None:
+            return
+        values, is_new = result
+        key = f"{prex}_indicator_{code}_{cycle}"
+        if is_new:
+            pipe.lpush(key, json.dumps(values))
         else:
-            if self.redis.exists(f"{prex}_ticket"):
-                # return_data = []
-                unclean_data = self.redis.hgetall(f"{prex}_ticket")
-                # for i in unclean_data:
-                #     return_data.append(json.loads(i))
-                return unclean_data
-        return {}
-
-    def load_kline(self, code, kline_type, prex='trade', limit=500):
-        # 获取 K线数据
-        return self.redis.lrange(f"{prex}_kline_{code}_{kline_type}", 0, limit)
+            pipe.lset(key, 0, json.dumps(values))
+        pipe.ltrim(key, 0, (limit or self.retention.limit(code, cycle)) - 1)
+
+    def queue_indicator_backfill(self, pipe, prex, code, cycle, ctm, closes):
+        # 用升序的 ctm 和收盘价数组批量计算整个指标列表并替换
+        rows = self.indicators.backfill(prex, code, cycle, ctm, closes)
+        self.queue_replace(pipe, f"{prex}_indicator_{code}_{cycle}", [json.dumps(row) for row in rows[::-1]])
+
+    def load_kline_history(self, code, kline_type, start=None, end=None, prex='trade'):
+        # 从本地历史文件读取 start <= ctm <= end 的 K线列数组（内存映射，不复制数据）
+        if not self.history:
+            return None
+        return self.history.read_arrays(prex, code, kline_type, start, end)
+
+    def record_history(self, prex, pending, results=None):
+        # 事务成功执行后把已收盘的 K线追加到本地历史，事务失败时不写，避免磁盘上有 Redis 没有的 K线
+        # pending 由 queue_* 方法收集：{'code', 'cycle', 'klines'} 为已知的 K线
+        # {'code', 'cycles', 'result'} 为流水线中 Lua 脚本的结果位置，脚本返回被取代的头部 K线
+        if not self.history:
+            return
+        for item in pending:
+            if 'result' not in item:
+                self.history.append(prex, item['code'], item['cycle'], item['klines'])
+                continue
+            closed = results[item['result']]
+            for i, raw in zip(closed[::2], closed[1::2]):
+                self.history.append(prex, item['code'], item['cycles'][int(i) - 1], [self.decode_kline(raw)])
+
+    def load_kline_range(self, code, kline_type, start=None, end=None, prex='trade', limit=None):
+        # 获取 start <= ctm <= end 的 K线（按时间降序），start/end 为 None 表示不限
+        # limit 为 None 时最多返回保留策略的条数
+        limit = self.retention.limit(code, kline_type) if limit is None else limit
+        if not self.indexed:
+            return [kline for kline in self.load_kline(code, kline_type, prex, limit=-1, decode=True)
+                    if (start is None or int(kline['ctm']) >= start)
+                    and (end is None or int(kline['ctm']) <= end)][:limit]
+        data = self.kline_redis.zrevrangebyscore(
+            f"{prex}_kindex_{code}_{kline_type}",
+            '+inf' if end is None else end,
+            '-inf' if start is None else start,
+            start=0, num=limit)
+        return [self.decode_kline(raw) for raw in data]
+
+    def load_kline_since(self, code, kline_type, ctm, prex='trade', limit=None):
+        # 获取 ctm 及之后的 K线，包含可能仍在更新的 ctm 那一条，用于增量刷新
+        return self.load_kline_range(code, kline_type, start=int(ctm), prex=prex, limit=limit)
+
+    def queue_index(self, pipe, key, kline, limit=500):
+        # 把 K线写入按时间索引的有序集合，同一 ctm 只保留一条
+        ctm = int(kline['ctm'])
+        pipe.zremrangebyscore(key, ctm, ctm)
+        pipe.zadd(key, {self.encode_kline(kline): ctm})
+        pipe.zremrangebyrank(key, 0, -limit - 1)
+
+    def encode_kline(self, kline):
+        return encode_kline(kline, self.packed)
+
+    def decode_kline(self, raw):
+        return decode_kline(raw)
 
     def save_ticket(self, ticket, prex='trade'):
-        # 存储票据
-        existing_ticket = self.redis.hget(f"{prex}_ticket", ticket['code'])
-        if not existing_ticket:
-            return self.redis.hset(f"{prex}_ticket", ticket['code'], json.dumps(ticket))
+        # 存储票据，返回报价是否有变化；价格未变化时跳过，超过 ticket_refresh 秒的定期重写也返回 False
+        status = self.ticket_status(ticket, prex)
+        if status is None:
+            return False
+        self.redis.hset(f"{prex}_ticket", ticket['code'], json.dumps(ticket))
+        self.remember_tickets([ticket], prex)
+        return status == 'changed'
+
+    def ticket_fingerprint(self, ticket):
+        return hash(tuple(ticket.get(field) for field in self.ticket_fields))
+
+    def ticket_status(self, ticket, prex='trade'):
+        # 与上次成功写入的报价指纹比较：有变化返回 'changed'，没有变化但超过 ticket_refresh 秒需要重写返回 'stale'
+        # 不需要写入返回 None
+        cached = self.ticket_fingerprints.get((prex, ticket['code']))
+        if not cached or cached[0] != self.ticket_fingerprint(ticket):
+            return 'changed'
+        if time.monotonic() - cached[1] >= self.ticket_refresh:
+            return 'stale'
+        return None
+
+    def remember_tickets(self, tickets, prex='trade'):
+        # 写入成功后才记录指纹，写入失败时下一轮同样的报价仍会重写
+        now = time.monotonic()
+        for ticket in tickets:
+            self.ticket_fingerprints[(prex, ticket['code'])] = (self.ticket_fingerprint(ticket), now)
+
+    def reset_ticket_cache(self, prex=None):
+        # 清空报价指纹缓存，prex 为 None 时清空全部
+        if prex is None:
+            self.ticket_fingerprints.clear()
         else:
-            existing_ticket = json.loads(existing_ticket)
-            self.redis.hset(f"{prex}_ticket", ticket['code'], json.dumps(ticket))
-            # if (existing_ticket["ticket"]['price'] == ticket["ticket"]['price'] and
-            #         existing_ticket["ticket"]['ask'] == ticket["ticket"]['ask'] and
-            #         existing_ticket["ticket"]['bid'] == ticket["ticket"]['bid']):
-            #     return False
-            return True
+            for key in [key for key in self.ticket_fingerprints if key[0] == prex]:
+                del self.ticket_fingerprints[key]
 
 
 #  git pull https://github.com/TheRealTrashMaker/future.git
-    def save_klines(self, klines, prex='trade', cycle=None, code=None):
-        #  存储多个 K线
+    def save_klines(self, klines, prex='trade', cycle=None, code=None, merge=False):
+        #  存储多个 K线，merge=True 时只写入比已有数据新或有变化的 K线
+        if merge:
+            self.merge_klines([(code, cycle, klines)], prex)
+        else:
+            pending = []
+            pipe = self.kline_redis.pipeline(transaction=True)
+            self.queue_save_klines(pipe, klines, prex, cycle, code, pending)
+            pipe.execute()
+            self.record_history(prex, pending)
+        print(f"{code}***{cycle}线完成")
 
-        self.redis.delete(f"{prex}_kline_{code}_{cycle}")
-        klines = sorted(klines, key=lambda x: x['ctm'], reverse=True)  # 按时间降序排列
-        for kline in klines:
-            self.redis.rpush(f"{prex}_kline_{code}_{cycle}", json.dumps(kline))
+    def queue_replace(self, pipe, key, values):
+        #  先写入临时键再 RENAME，读者始终看到完整的旧列表或新列表
+        if not values:
+            pipe.delete(key)
+            return
+        temp = f"{key}:tmp:{uuid.uuid4().hex[:8]}"
+        pipe.rpush(temp, *values)
+        pipe.rename(temp, key)
 
-        print(f"{code}***{cycle}线完成")
+    def queue_save_klines(self, pipe, klines, prex='trade', cycle=None, code=None, pending=None):
+        #  把整体替换一个 K线列表的命令加入 pipe，由调用方 execute，可在一个流水线中写入多个列表
+        #  pending 为列表时收集待写入历史的 K线，调用方 execute 成功后交给 record_history
+        key = f"{prex}_kline_{code}_{cycle}"
+        klines = sorted(klines, key=lambda x: int(x['ctm']), reverse=True)  # 按时间降序排列
+        self.queue_replace(pipe, key, [self.encode_kline(kline) for kline in klines])
+        self.bump_kline_version(key, prex, replaced=True, client=pipe)
+        if self.history and pending is not None and len(klines) > 1:
+            # 最新一条可能还未收盘，不写入历史
+            pending.append({'code': code, 'cycle': cycle, 'klines': klines[1:]})
+        if self.indexed:
+            index_key = f"{prex}_kindex_{code}_{cycle}"
+            if klines:
+                temp = f"{index_key}:tmp:{uuid.uuid4().hex[:8]}"
+                pipe.zadd(temp, {self.encode_kline(kline): int(kline['ctm']) for kline in klines})
+                pipe.rename(temp, index_key)
+            else:
+                pipe.delete(index_key)
+        if self.indicators:
+            ordered = klines[::-1]
+            self.queue_indicator_backfill(pipe, prex, code, cycle, [int(kline['ctm']) for kline in ordered],
+                                          [float(kline['close']) for kline in ordered])
 
-    def save_kline(self, ticket, prex='trade', is_ask=True):
-        #  存储单条 K线
-        for cycle in self.cycles:
-            kline_data = self.redis.lrange(f"{prex}_kline_{ticket['code']}_{cycle}", 0, 0)
-            if kline_data:
-                kline = json.loads(kline_data[0])
+    def merge_klines(self, items, prex='trade', retries=3):
+        #  增量合并多个 K线列表 [(code, cycle, klines)]：一个流水线读出已有列表，一个事务只写入新增或变化的 K线
+        #  WATCH 期间列表被其他写入者修改时重试，重试用尽后整体替换
+        #  返回 {'pushed', 'updated', 'replaced', 'unchanged'}
+        stats = {'pushed': 0, 'updated': 0, 'replaced': 0, 'unchanged': 0}
+        if not items:
+            return stats
+        keys = [f"{prex}_kline_{code}_{cycle}" for code, cycle, _ in items]
+        with self.kline_redis.pipeline(transaction=True) as pipe:
+            for _ in range(retries):
+                try:
+                    pipe.watch(*keys)
+                    reader = self.kline_redis.pipeline(transaction=False)
+                    for key in keys:
+                        reader.lrange(key, 0, -1)
+                    stored = reader.execute()
+                    pipe.multi()
+                    result = {name: 0 for name in stats}
+                    pending = []
+                    for (code, cycle, klines), raws in zip(items, stored):
+                        result[self.queue_merge_klines(pipe, klines, raws, prex, cycle, code, pending)] += 1
+                    pipe.execute()
+                    self.record_history(prex, pending)
+                    for name, value in result.items():
+                        stats[name] += value
+                    return stats
+                except redis.WatchError:
+                    continue
+            pipe.reset()
+            pending = []
+            for code, cycle, klines in items:
+                self.queue_save_klines(pipe, klines, prex, cycle, code, pending)
+            pipe.execute()
+            self.record_history(prex, pending)
+            stats['replaced'] += len(items)
+            return stats
+
+    def queue_merge_klines(self, pipe, klines, raws, prex='trade', cycle=None, code=None, pending=None):
+        #  对比已有列表 raws（时间降序）与新获取的 K线，把写入命令加入 pipe，返回采用的方式
+        #  新 K线 LPUSH，已有但内容变化的 K线按位置 LSET；已有数据中间缺少 K线时整体替换为合并后的列表
+        key = f"{prex}_kline_{code}_{cycle}"
+        limit = self.retention.limit(code, cycle)
+        fetched = sorted(klines, key=lambda x: int(x['ctm']))
+        if not raws:
+            self.queue_save_klines(pipe, fetched, prex, cycle, code, pending)
+            return 'replaced'
+
+        stored = [self.decode_kline(raw) for raw in raws]
+        positions = {int(kline['ctm']): index for index, kline in enumerate(stored)}
+        head_ctm = int(stored[0]['ctm'])
+        oldest_ctm = int(stored[-1]['ctm'])
+        pushed = []
+        updated = []
+        for kline in fetched:
+            ctm = int(kline['ctm'])
+            if ctm > head_ctm:
+                pushed.append(kline)
+            elif ctm in positions:
+                if self.encode_kline(kline) != raws[positions[ctm]]:
+                    updated.append((positions[ctm], kline))
+            elif ctm > oldest_ctm:
+                # 已有列表中间缺少这条 K线，无法按位置插入
+                merged = {int(x['ctm']): x for x in stored}
+                merged.update((int(x['ctm']), x) for x in fetched)
+                bars = [merged[ctm] for ctm in sorted(merged, reverse=True)[:limit]]
+                self.queue_save_klines(pipe, bars, prex, cycle, code, pending)
+                return 'replaced'
+        if not pushed and not updated:
+            return 'unchanged'
+
+        for index, kline in updated:
+            pipe.lset(key, index, self.encode_kline(kline))
+        if pushed:
+            pipe.lpush(key, *[self.encode_kline(kline) for kline in pushed])
+            pipe.ltrim(key, 0, limit - 1)
+        # 只改动头部时读缓存可以直接修补，否则整体失效
+        self.bump_kline_version(key, prex, replaced=len(pushed) > 1 or any(index for index, _ in updated),
+                                client=pipe)
+        written = [kline for _, kline in sorted(updated, reverse=True)] + pushed
+        # 合并后的整个列表（时间升序）
+        for index, kline in updated:
+            stored[index] = kline
+        merged = stored[::-1] + pushed
+        if self.indexed:
+            for kline in written:
+                self.queue_index(pipe, f"{prex}_kindex_{code}_{cycle}", kline, limit)
+        if self.history and pending is not None:
+            # 最新一条之前的 K线都已收盘，包括没有变化、这次没有写入的原头部 K线
+            # 历史文件只追加比最后一条更新的 K线，已写过的会被跳过
+            pending.append({'code': code, 'cycle': cycle, 'klines': merged[:-1]})
+        if self.indicators:
+            if any(index for index, _ in updated):
+                # 历史 K线有变化，指标整体重算
+                bars = merged[-limit:]
+                self.queue_indicator_backfill(pipe, prex, code, cycle, [int(x['ctm']) for x in bars],
+                                              [float(x['close']) for x in bars])
             else:
-                kline = {'open': 0, 'high': 0, 'close': 0, 'low': 0, 'wave': 0, 'volume': 0}
-
-            price = round(ticket['ask'] if is_ask else ticket['bid'], ticket['digit'])
-            price = price if price != 0 else ticket['price']
-            this_ctmfmt = self.get_key(cycle, ticket['ctmfmt'])
-            this_ctm = int(datetime.strptime(this_ctmfmt, '%Y-%m-%d %H:%M:%S').timestamp())
-
-            if this_ctm:
-                if 'ctm' in kline and this_ctm == kline['ctm']:
-                    # 更新 K线数据
-                    kline['high'] = max(kline['open'], kline['high'], kline['low'], kline['close'], price)
-                    kline['low'] = min(kline['open'], kline['high'], kline['low'], kline['close'], price) or ticket['price']
-                    kline['close'] = price
-                    kline['wave'] = ticket.get('wave')
-                    kline['volume'] = ticket.get('volume')
-                    kline['price'] = ticket.get('price')
-                    kline['ctm'] = this_ctm
-                    kline['ctmfmt'] = this_ctmfmt
-
-                    self.redis.lset(f"{prex}_kline_{ticket['code']}_{cycle}", 0, json.dumps(kline))
-                    last_kline_data = self.redis.lrange(f"{prex}_kline_{ticket['code']}_{cycle}", 1, 1)
-                    if last_kline_data and 'ctm' in json.loads(last_kline_data[0]) and this_ctm == json.loads(last_kline_data[0])['ctm']:
-                        self.redis.lpop('list')
+                for kline in written:
+                    self.queue_indicators(pipe, prex, code, cycle, {'ctm': int(kline['ctm']),
+                                                                    'close': float(kline['close'])}, limit)
+        return 'pushed' if pushed else 'updated'
+
+    def save_kline(self, ticket, prex='trade', is_ask=True):
+        #  存储单条 K线，一次往返的写入方式是 atomic=True 的 Lua 脚本（save_kline_atomic）
+        if self.atomic:
+            return self.save_kline_atomic(ticket, prex, is_ask)
+        self.write_klines([ticket], prex, is_ask)
+
+    def write_klines(self, tickets, prex='trade', is_ask=True, ticket_mapping=None):
+        #  WATCH 报价涉及的所有 K线列表，一个流水线读出头部 K线，再用一个事务写回
+        #  读写之间列表被其他写入者修改时事务被放弃并重试，每次三次往返（WATCH、读、MULTI/EXEC）
+        #  ticket_mapping 不为空时在同一事务中写入报价哈希
+        codes = list(dict.fromkeys(ticket['code'] for ticket in tickets))
+        keys = [f"{prex}_kline_{code}_{cycle}" for code in codes for cycle in self.cycles]
+        with self.kline_redis.pipeline(transaction=True) as pipe:
+            while True:
+                pending = []
+                try:
+                    pipe.watch(*keys)
+                    heads = self.read_heads(keys)
+                    pipe.multi()
+                    self.queue_klines(pipe, tickets, prex, is_ask, pending, heads)
+                    if ticket_mapping:
+                        pipe.hset(f"{prex}_ticket", mapping=ticket_mapping)
+                    results = pipe.execute()
+                    break
+                except redis.WatchError:
+                    if self.indicators:
+                        # 指标状态已按放弃的事务更新过，重新从 Redis 回填
+                        for code in codes:
+                            for cycle in self.cycles:
+                                self.indicators.discard(prex, code, cycle)
+        self.record_history(prex, pending, results)
+
+    def save_kline_atomic(self, ticket, prex='trade', is_ask=True, cycles=None, client=None, pending=None):
+        #  存储单条 K线：一次 EVALSHA 完成所有周期的合并、新建和裁剪
+        #  client 为流水线时脚本结果由调用方 execute 后取得，pending 记录结果位置，交给 record_history
+        keys = []
+        used_cycles = []
+        price = self.get_price(ticket, is_ask)
+        args = [json.dumps({
+            'price': price,
+            'tick_price': ticket.get('price'),
+            'wave': ticket.get('wave'),
+            'volume': ticket.get('volume'),
+        }), 1 if self.indexed else 0]
+        index_keys = []
+        for cycle, this_ctm, this_ctmfmt in self.get_buckets(ticket):
+            if cycles and cycle not in cycles:
+                continue
+            keys.append(f"{prex}_kline_{ticket['code']}_{cycle}")
+            used_cycles.append(cycle)
+            index_keys.append(f"{prex}_kindex_{ticket['code']}_{cycle}")
+            args.extend([this_ctm, this_ctmfmt, self.retention.limit(ticket['code'], cycle)])
+        if keys:
+            keys = keys + index_keys if self.indexed else keys
+            if self.history and client is not None and pending is not None:
+                pending.append({'code': ticket['code'], 'cycles': used_cycles, 'result': len(client.command_stack)})
+            closed = self.kline_upsert(keys=keys + [f"{prex}_kline_version"], args=args, client=client)
+            if self.indicators:
+                # 脚本合并后头部 K线的收盘价即为本次成交价
+                pipe = client or self.kline_redis.pipeline(transaction=True)
+                for cycle, ctm in zip(used_cycles, args[2::3]):
+                    self.queue_indicators(pipe, prex, ticket['code'], cycle, {'ctm': ctm, 'close': price})
+                if client is None:
+                    pipe.execute()
+            if self.history and client is None:
+                for i, raw in zip(closed[::2], closed[1::2]):
+                    self.history.append(prex, ticket['code'], used_cycles[int(i) - 1], [self.decode_kline(raw)])
+
+    def read_heads(self, keys):
+        #  一个流水线读出各列表的头部两条 K线 {key: [头部 K线, 第二条 K线]}，不存在的为 None
+        reader = self.kline_redis.pipeline(transaction=False)
+        for key in keys:
+            reader.lrange(key, 0, 1)
+        return {key: [self.decode_kline(x) for x in head] + [None] * (2 - len(head))
+                for key, head in zip(keys, reader.execute())}
+
+    def queue_klines(self, pipe, tickets, prex='trade', is_ask=True, pending=None, heads=None):
+        #  把多笔报价的 K线写入命令加入 pipe，由调用方 execute
+        #  pending 为列表时收集已收盘的 K线，调用方 execute 成功后用 record_history(prex, pending, 结果) 写入历史
+        #  heads 为调用方已读出的头部 K线（read_heads），为 None 时在这里读取
+        if self.atomic:
+            for ticket in tickets:
+                self.save_kline_atomic(ticket, prex, is_ask, client=pipe, pending=pending)
+            return
+
+        if heads is None:
+            heads = self.read_heads(list({f"{prex}_kline_{ticket['code']}_{cycle}": None
+                                          for ticket in tickets for cycle in self.cycles}))
+        # 同一批次内同一合约的多笔报价依次合并
+
+        for ticket in tickets:
+            code = ticket['code']
+            price = self.get_price(ticket, is_ask)
+            merged = self.merge_ticket({cycle: heads[f"{prex}_kline_{code}_{cycle}"][0] for cycle in self.cycles},
+                                       ticket, price)
+            for cycle, kline, is_new in merged:
+                key = f"{prex}_kline_{code}_{cycle}"
+                head, second = heads[key]
+                if is_new:
+                    pipe.lpush(key, self.encode_kline(kline))
+                    heads[key] = [kline, head]
+                    if head and self.history and pending is not None:
+                        pending.append({'code': code, 'cycle': cycle, 'klines': [head]})
                 else:
-                    # 创建新的 K线数据
-                    kline = {
-                        'open': price,
-                        'high': price,
-                        'low': price,
-                        'close': price,
-                        'wave': ticket.get('wave'),
-                        'volume': ticket.get('volume'),
-                        'price': ticket.get('price'),
-                        'ctm': this_ctm,
-                        'ctmfmt': this_ctmfmt
-                    }
-                    self.redis.lpush(f"{prex}_kline_{ticket['code']}_{cycle}", json.dumps(kline))
-
-                if self.redis.llen(f"{prex}_kline_{ticket['code']}_{cycle}") > 500:
-                    self.redis.ltrim(f"{prex}_kline_{ticket['code']}_{cycle}", 0, 499)  # 保留前500个元素
+                    pipe.lset(key, 0, self.encode_kline(kline))
+                    if second and second.get('ctm') == kline['ctm']:
+                        # 删除与头部重复的第二条 K线
+                        pipe.lset(key, 1, '__removed__')
+                        pipe.lrem(key, 1, '__removed__')
+                        second = None
+                    heads[key] = [kline, second]
+                limit = self.retention.limit(code, cycle)
+                pipe.ltrim(key, 0, limit - 1)  # 按保留策略裁剪
+                pipe.hincrby(f"{prex}_kline_version", key, 1)
+                if self.indexed:
+                    self.queue_index(pipe, f"{prex}_kindex_{code}_{cycle}", kline, limit)
+                if self.indicators:
+                    self.queue_indicators(pipe, prex, code, cycle, kline, limit)
+
+    def save_tickets(self, tickets, prex='trade', with_kline=False, is_ask=True):
+        # 批量存储票据，with_kline=True 时在同一事务中更新所有周期的 K线
+        # 返回价格有变化的票据数，超过 ticket_refresh 秒的定期重写会写入但不计数
+        tickets = [ticket for ticket in tickets if ticket and 'ctm' in ticket and 'code' in ticket]
+        statuses = [(ticket, self.ticket_status(ticket, prex)) for ticket in tickets]
+        changed_tickets = [ticket for ticket, status in statuses if status]
+        changed = {ticket['code']: json.dumps(ticket) for ticket in changed_tickets}
+        count = len({ticket['code'] for ticket, status in statuses if status == 'changed'})
+        if not changed and not (with_kline and tickets):
+            return 0
+        if with_kline and not self.atomic:
+            # 与 save_kline 相同，在 WATCH 下读出头部 K线，避免并发写入者重复新建 K线
+            self.write_klines(tickets, prex, is_ask, changed)
+            self.remember_tickets(changed_tickets, prex)
+            return count
+        pending = []
+        pipe = self.kline_redis.pipeline(transaction=True)
+        if with_kline:
+            self.queue_klines(pipe, tickets, prex, is_ask, pending)
+        if changed:
+            pipe.hset(f"{prex}_ticket", mapping=changed)
+        self.record_history(prex, pending, pipe.execute())
+        self.remember_tickets(changed_tickets, prex)
+        return count
+
+    save_many = save_tickets
+
+    def get_buckets(self, ticket):
+        # 报价所在的各周期 K线 [(周期名, ctm, ctmfmt)]
+        if self.sessions and self.sessions.knows(ticket['code']):
+            return self.sessions.bucket_all(ticket['code'], ticket['ctm'])
+        return self.bucketer.bucket_all(ticket['ctm'])
+
+    def get_bucket(self, code, m, ts):
+        # 单个周期分桶，返回 (ctm, ctmfmt)，休市或不支持的周期返回 None
+        if self.sessions and self.sessions.knows(code):
+            ctm = self.sessions.bucket(code, m, ts)
+        else:
+            ctm = self.bucketer.bucket(m, ts)
+        return None if ctm is None else (ctm, self.bucketer.format(m, ctm))
+
+    def get_price(self, ticket, is_ask=True):
+        # 取卖价或买价作为成交价，为 0 时使用最新价
+        price = round(ticket['ask'] if is_ask else ticket['bid'], ticket['digit'])
+        return price if price != 0 else ticket['price']
+
+    def merge_ticket(self, heads, ticket, price):
+        # 把一笔报价合并进各周期的头部 K线
+        # heads: 周期名 -> 头部 K线，返回 [(周期名, K线, 是否新建)]
+        if self.cascade:
+            return self.merge_cascade(heads, ticket, price)
+        return [(cycle,) + self.merge_kline(heads.get(cycle), ticket, price, this_ctm, this_ctmfmt)
+                for cycle, this_ctm, this_ctmfmt in self.get_buckets(ticket)]
+
+    def merge_cascade(self, heads, ticket, price):
+        # 级联合并：只对 1 分钟 K线合并报价，其余周期从下一级 K线推导
+        # 下一级没有换线时上级的 ctm 不变，不需要重新分桶
+        base, code = self.cascade_base, ticket['code']
+        bucket = self.get_bucket(code, self.cycles[base], ticket['ctm'])
+        if not bucket:
+            return []
+        merged = {base: self.merge_kline(heads.get(base), ticket, price, *bucket)}
+        for cycle, parent in self.cascade_parents.items():
+            if cycle not in self.cycles:
+                continue
+            # 上一级周期未保存时由更低一级推导
+            while parent not in merged and parent in self.cascade_parents:
+                parent = self.cascade_parents[parent]
+            if parent not in merged:
+                continue
+            child, child_new = merged[parent]
+            head = heads.get(cycle)
+            if child_new or not head:
+                bucket = self.get_bucket(code, self.cycles[cycle], child['ctm'])
+                if not bucket:
+                    continue
+                this_ctm, this_ctmfmt = bucket
+            else:
+                this_ctm, this_ctmfmt = head['ctm'], head['ctmfmt']
+            merged[cycle] = self.roll_kline(head, child, this_ctm, this_ctmfmt)
+        return [(cycle,) + merged[cycle] for cycle in self.cycles if cycle in merged]
+
+    def roll_kline(self, kline, child, this_ctm, this_ctmfmt):
+        # 用下一级 K线更新上级 K线，返回 (K线, 是否新建)
+        if kline and 'ctm' in kline and this_ctm == kline['ctm']:
+            kline['high'] = max(kline['high'], child['high'])
+            kline['low'] = min(kline['low'], child['low'])
+            kline['close'] = child['close']
+            kline['wave'] = child['wave']
+            kline['volume'] = child['volume']
+            kline['price'] = child['price']
+            kline['ctmfmt'] = this_ctmfmt
+            return kline, False
+        return {
+            'open': child['open'],
+            'high': child['high'],
+            'low': child['low'],
+            'close': child['close'],
+            'wave': child['wave'],
+            'volume': child['volume'],
+            'price': child['price'],
+            'ctm': this_ctm,
+            'ctmfmt': this_ctmfmt
+        }, True
+
+    def merge_kline(self, kline, ticket, price, this_ctm, this_ctmfmt):
+        # 把一笔报价合并进头部 K线，返回 (K线, 是否新建)
+        if kline and 'ctm' in kline and this_ctm == kline['ctm']:
+            # 更新 K线数据
+            kline['high'] = max(kline['open'], kline['high'], kline['low'], kline['close'], price)
+            kline['low'] = min(kline['open'], kline['high'], kline['low'], kline['close'], price) or ticket['price']
+            kline['close'] = price
+            kline['wave'] = ticket.get('wave')
+            kline['volume'] = ticket.get('volume')
+            kline['price'] = ticket.get('price')
+            kline['ctm'] = this_ctm
+            kline['ctmfmt'] = this_ctmfmt
+            return kline, False
+        # 创建新的 K线数据
+        return {
+            'open': price,
+            'high': price,
+            'low': price,
+            'close': price,
+            'wave': ticket.get('wave'),
+            'volume': ticket.get('volume'),
+            'price': ticket.get('price'),
+            'ctm': this_ctm,
+            'ctmfmt': this_ctmfmt
+        }, True
+
+    def parse_key(self, key):
+        # get_key 返回 '%Y-%m-%d %H:%M' 或 '%Y-%m-%d'，转换为十位数时间戳
+        if not key:
+            return None
+        fmt = '%Y-%m-%d %H:%M' if ' ' in key else '%Y-%m-%d'
+        return int(datetime.strptime(key, fmt).timestamp())
 
     def get_key(self, m, datetime_str, previous_key=False):
         datetime_obj = datetime.strptime(datetime_str, '%Y-%m-%d %H:%M:%S')
@@ -152,11 +914,11 @@ class KlineService:
 
             if m > 60:  # 处理小时
                 hour_list = [0]
-                if m == 240:
+                if (24 * 60) % m == 0:
                     nums = (24 * 60) // m
                     for i in range(nums):
                         last = hour_list[-1]
-                        hour_list.append(last + 4)
+                        hour_list.append(last + m // 60)
 
                     for lk, lv in enumerate(hour_list):
                         if datetime_obj.hour <= lv:
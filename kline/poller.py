@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from .quotes import parse_quotes
+    from .upstream import QUOTE_HEADERS, QUOTE_HOST, get_session, quote_url
+except ImportError:
+    from quotes import parse_quotes
+    from upstream import QUOTE_HEADERS, QUOTE_HOST, get_session, quote_url
+
+
+class QuotePoller:
+    def __init__(self, symbols, shard_size=100, workers=8, host=QUOTE_HOST, timeout=5):
+        # 把合约列表分成每批 shard_size 个，用共享连接池并发请求，先返回的分片先解析合并
+        # 单个分片超时或失败不影响其余分片，失败的合约在 errors 中报告
+        self.symbols = list(symbols)
+        self.shards = [self.symbols[i:i + shard_size] for i in range(0, len(self.symbols), shard_size)]
+        self.host = host
+        self.timeout = timeout
+        self.session = get_session()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stats = [{'requests': 0, 'failures': 0, 'last': None, 'avg': None, 'max': 0.0, 'error': None}
+                      for _ in self.shards]
+
+    def fetch_shard(self, index):
+        # 请求一个分片，返回 (分片序号, 响应原文, 耗时)
+        start = time.perf_counter()
+        response = self.session.get(quote_url(self.shards[index], self.host), headers=QUOTE_HEADERS,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        return index, response.text, time.perf_counter() - start
+
+    def record(self, index, seconds=None, error=None):
+        # 更新分片统计，avg 为耗时的指数移动平均
+        stats = self.stats[index]
+        stats['requests'] += 1
+        stats['error'] = error
+        if error is not None:
+            stats['failures'] += 1
+            return
+        stats['last'] = seconds
+        stats['avg'] = seconds if stats['avg'] is None else stats['avg'] * 0.8 + seconds * 0.2
+        stats['max'] = max(stats['max'], seconds)
+
+    def fetch(self):
+        # 并发请求所有分片，按完成顺序产生 (分片序号, 响应原文)，失败的分片响应为 None
+        futures = {self.executor.submit(self.fetch_shard, index): index for index in range(len(self.shards))}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                _, text, seconds = future.result()
+            except Exception as e:
+                self.record(index, error=repr(e))
+                yield index, None
+                continue
+            self.record(index, seconds)
+            yield index, text
+
+    def poll(self):
+        # 获取并解析全市场报价，返回 (tickets, errors)
+        tickets = []
+        errors = []
+        for index, text in self.fetch():
+            if text is None:
+                errors.extend((symbol, f"分片 {index} 请求失败") for symbol in self.shards[index])
+                continue
+            shard_tickets, shard_errors = parse_quotes(text, self.shards[index])
+            tickets.extend(shard_tickets)
+            errors.extend(shard_errors)
+        return tickets, errors
+
+    def report(self):
+        # 每个分片的统计摘要
+        lines = []
+        for index, stats in enumerate(self.stats):
+            avg = f"{stats['avg'] * 1000:.0f}ms" if stats['avg'] is not None else '-'
+            lines.append(f"分片 {index}: {len(self.shards[index])} 个合约，请求 {stats['requests']}，"
+                         f"失败 {stats['failures']}，平均 {avg}，最长 {stats['max'] * 1000:.0f}ms")
+        return "\n".join(lines)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
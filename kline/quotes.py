@@ -0,0 +1,77 @@
+import re
+import time
+from functools import lru_cache
+
+# hq.sinajs.cn 返回的每一行：var hq_str_nf_<合约>="<逗号分隔的字段>";
+QUOTE_LINE = re.compile(r'var hq_str_nf_([A-Za-z0-9]+)="([^"\n]*)";?')
+# 商品期货字段位置：0.名字 1.时分秒 2.开盘价 3.最高价 4.最低价 5.结算价 6.买价 7.卖价 8.最新价 9.均价
+# 10.昨结 11.买量 12.卖量 13.持仓量 14.成交量，交易日期在连续 9 个逗号之前的倒数第二个字段
+MIN_FIELDS = 15
+
+
+@lru_cache(maxsize=64)
+def day_start(date):
+    # 交易日期（本地时间）零点的十位数时间戳
+    return int(time.mktime(time.strptime(date, '%Y-%m-%d')))
+
+
+def parse_quote(symbol, body):
+    # 解析一行报价为 ticket，格式错误时抛出 ValueError
+    fields = body.split(',')
+    if len(fields) < MIN_FIELDS:
+        raise ValueError(f"字段数不足: {len(fields)}")
+    head = body.split(',,,,,,,,,', 1)[0].rsplit(',', 2)
+    date, clock = head[-2] if len(head) == 3 else '', fields[1]
+    if len(date) != 10 or len(clock) != 6 or not clock.isdigit():
+        raise ValueError(f"时间格式错误: {date} {clock}")
+    timestamp = day_start(date) + int(clock[0:2]) * 3600 + int(clock[2:4]) * 60 + int(clock[4:6])
+    price = float(fields[8])
+    close = float(fields[10])
+    volume = float(fields[14])
+    if not close:
+        raise ValueError("昨结为 0")
+    return {
+        "ask": float(fields[6]),
+        "asm": float(fields[12]),
+        "bid": float(fields[7]),
+        "bim": float(fields[11]),
+        "open": float(fields[2]),
+        "close": close,
+        "nv": volume,
+        "high": float(fields[3]),
+        "low": float(fields[4]),
+        "wave": round((price - close) / close * 100, 2),
+        "price": price,
+        "volume": volume,
+        "position": float(fields[9]),
+        "digit": 4,
+        "code": symbol,
+        "code2": symbol,
+        "ctm": f"{timestamp}",
+        "ctmfmt": f"{date} {clock[0:2]}:{clock[2:4]}:{clock[4:6]}"
+    }
+
+
+def parse_quotes(text, symbols=None):
+    # 一次扫描整个响应，按行内的合约名（而不是位置）生成 ticket
+    # symbols 不为空时只保留其中的合约，并把响应中缺失的合约报告为错误
+    # 返回 (tickets, errors)，errors 为 [(合约, 原因)]
+    wanted = set(symbols) if symbols is not None else None
+    tickets = []
+    errors = []
+    seen = set()
+    for match in QUOTE_LINE.finditer(text):
+        symbol, body = match.group(1), match.group(2)
+        if wanted is not None and symbol not in wanted:
+            continue
+        seen.add(symbol)
+        if not body:
+            errors.append((symbol, "空报价"))
+            continue
+        try:
+            tickets.append(parse_quote(symbol, body))
+        except ValueError as e:
+            errors.append((symbol, str(e)))
+    if wanted is not None:
+        errors.extend((symbol, "响应中没有该合约") for symbol in symbols if symbol not in seen)
+    return tickets, errors
@@ -0,0 +1,280 @@
+import asyncio
+import base64
+import bisect
+import gzip
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# 录制文件：gzip 压缩的 JSON 行，每行一条记录，t 为相对录制开始的秒数
+# {"t", "kind": "http", "url", "status", "content_type", "body"(base64)}
+# {"t", "kind": "ws", "direction": "send"/"recv", "data"}
+
+
+def route_key(url):
+    # 同一接口的请求归为一类，去掉 URL 中的时间戳等易变部分
+    parts = urlsplit(url)
+    path = unquote(parts.path)
+    if 'getFewMinLine' in path:
+        query = parse_qs(parts.query)
+        return 'kline', query.get('symbol', [''])[0], query.get('type', [''])[0]
+    if 'list=' in path:
+        return 'quote', path.split('list=', 1)[1]
+    return 'path', path
+
+
+class Recorder:
+    def __init__(self, path):
+        # 线程安全地把上游响应和 websocket 帧追加到压缩文件
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        record['t'] = round(time.monotonic() - self.started, 6)
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.count += 1
+
+    def record_http(self, url, status, body, content_type=None):
+        self.write({'kind': 'http', 'url': url, 'status': status, 'content_type': content_type,
+                    'body': base64.b64encode(body).decode()})
+
+    def record_ws(self, direction, data):
+        self.write({'kind': 'ws', 'direction': direction,
+                    'data': data if isinstance(data, str) else base64.b64encode(data).decode(),
+                    'binary': not isinstance(data, str)})
+
+    def on_response(self, response, *args, **kwargs):
+        # requests 的 response 钩子：recorder.attach(session) 后自动录制该 session 的所有响应
+        self.record_http(response.url, response.status_code, response.content, response.headers.get('Content-Type'))
+        return response
+
+    def attach(self, session):
+        session.hooks['response'].append(self.on_response)
+        return session
+
+    def wrap(self, connection):
+        # 包装 websocket 连接，send/recv 的帧同时录制
+        return RecordingConnection(connection, self)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class RecordingConnection:
+    def __init__(self, connection, recorder):
+        self.connection = connection
+        self.recorder = recorder
+
+    async def send(self, message):
+        self.recorder.record_ws('send', message)
+        await self.connection.send(message)
+
+    async def recv(self):
+        message = await self.connection.recv()
+        self.recorder.record_ws('recv', message)
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except websockets.ConnectionClosed:
+            raise StopAsyncIteration
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def load_records(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class ReplayServer:
+    def __init__(self, path, speed=1.0, host='127.0.0.1', http_port=0, ws_port=0):
+        # 本地替身服务器，按录制时的时间线回放：
+        # HTTP 请求返回同一接口在当前回放时刻之前最后一次录制的响应（还没有时返回第一次的）
+        # websocket 每个新连接从头按原间隔推送录制时收到的帧
+        # speed 为回放倍速，0 表示不等待，尽快回放
+        self.records = load_records(path)
+        self.speed = speed
+        self.host = host
+        self.http_port = http_port
+        self.ws_port = ws_port
+        self.routes = {}
+        for record in self.records:
+            if record['kind'] == 'http':
+                self.routes.setdefault(route_key(record['url']), []).append(record)
+        self.times = {key: [record['t'] for record in records] for key, records in self.routes.items()}
+        self.frames = [record for record in self.records if record['kind'] == 'ws' and record['direction'] == 'recv']
+        self.started = None
+        self.http_server = None
+        self.loop = None
+        self.ws_server = None
+        self.threads = []
+        self.stats = {'http': 0, 'misses': 0, 'ws_connections': 0, 'frames': 0}
+
+    def elapsed(self):
+        # 当前回放时刻（录制时间线上的秒数）
+        if not self.speed:
+            return float('inf')
+        return (time.monotonic() - self.started) * self.speed
+
+    def lookup(self, url):
+        key = route_key(url)
+        records = self.routes.get(key)
+        if not records and key[0] == 'kline':
+            # K线接口按合约匹配不到时返回同周期的任意录制
+            records = next((value for k, value in self.routes.items() if k[0] == 'kline' and k[2] == key[2]), None)
+        if not records:
+            return None
+        index = bisect.bisect_right(self.times.get(key, [record['t'] for record in records]), self.elapsed()) - 1
+        return records[max(index, 0)]
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.stats['http'] += 1
+                record = server.lookup(self.path)
+                if record is None:
+                    server.stats['misses'] += 1
+                    body, status, content_type = b'', 404, 'text/plain'
+                else:
+                    body = base64.b64decode(record['body'])
+                    status, content_type = record['status'], record['content_type'] or 'text/plain'
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    async def stream(self, connection):
+        # 按录制间隔推送帧，客户端发来的订阅命令忽略
+        self.stats['ws_connections'] += 1
+        start = time.monotonic()
+        first = self.frames[0]['t'] if self.frames else 0
+        for frame in self.frames:
+            if self.speed:
+                delay = (frame['t'] - first) / self.speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            data = base64.b64decode(frame['data']) if frame.get('binary') else frame['data']
+            await connection.send(data)
+            self.stats['frames'] += 1
+        await connection.wait_closed()
+
+    def run_ws(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        async def serve():
+            self.ws_server = await websockets.serve(self.stream, self.host, self.ws_port)
+            self.ws_port = self.ws_server.sockets[0].getsockname()[1]
+            ready.set()
+            await self.ws_server.wait_closed()
+
+        self.loop.run_until_complete(serve())
+
+    def start(self):
+        # 启动 HTTP 和 websocket 服务，回放时钟从此刻开始
+        self.started = time.monotonic()
+        self.http_server = ThreadingHTTPServer((self.host, self.http_port), self.make_handler())
+        self.http_server.daemon_threads = True
+        self.http_port = self.http_server.server_address[1]
+        self.threads.append(threading.Thread(target=self.http_server.serve_forever, daemon=True))
+        if websockets is not None:
+            ready = threading.Event()
+            self.threads.append(threading.Thread(target=self.run_ws, args=(ready,), daemon=True))
+        for thread in self.threads:
+            thread.start()
+        if websockets is not None:
+            ready.wait()
+        return self
+
+    @property
+    def http_url(self):
+        return f"http://{self.host}:{self.http_port}"
+
+    @property
+    def ws_url(self):
+        return f"ws://{self.host}:{self.ws_port}"
+
+    def stop(self):
+        self.http_server.shutdown()
+        if self.ws_server is not None:
+            self.loop.call_soon_threadsafe(self.ws_server.close)
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.threads = []
+
+
+def record_market(path, seconds=60, interval=1.0):
+    # 录制 seconds 秒的全市场报价轮询和各合约 1 分钟 K线，需要访问上游
+    try:
+        from .poller import QuotePoller
+        from .upstream import fetch_kline, get_session
+    except ImportError:
+        from poller import QuotePoller
+        from upstream import fetch_kline, get_session
+    with open(__file__.rsplit('/', 1)[0] + '/futures.json', 'r', encoding='utf-8') as file:
+        symbols = [item['symbol'] for item in json.load(file) if item['exchange'] != 'cffex']
+    recorder = Recorder(path)
+    recorder.attach(get_session())
+    poller = QuotePoller(symbols)
+    try:
+        for symbol in symbols:
+            fetch_kline(symbol, '1')
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            poller.poll()
+            time.sleep(interval)
+    finally:
+        poller.close()
+        recorder.close()
+    return recorder.count
+
+
+if __name__ == '__main__':
+    # 用法: python replay.py record 文件 [秒数]      录制上游数据
+    #       python replay.py serve 文件 [倍速] [HTTP端口] [WS端口]
+    # 回放时设置环境变量 QUOTE_HOST、KLINE_HOST 为 HTTP 地址，MARKET_WS_URI 为 websocket 地址
+    command, path = sys.argv[1], sys.argv[2]
+    if command == 'record':
+        print(f"已录制 {record_market(path, float(sys.argv[3]) if len(sys.argv) > 3 else 60)} 条")
+    elif command == 'serve':
+        args = sys.argv[3:] + [None] * 3
+        server = ReplayServer(path, speed=float(args[0] or 1), http_port=int(args[1] or 0),
+                              ws_port=int(args[2] or 0)).start()
+        print(f"HTTP: {server.http_url}  WS: {server.ws_url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        raise SystemExit(f"未知命令: {command}")
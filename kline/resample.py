@@ -0,0 +1,120 @@
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from .arrays import require_numpy
+    from .bucketing import DAY, MINUTE
+    from .sessions import CLOSED
+except ImportError:
+    from arrays import require_numpy
+    from bucketing import DAY, MINUTE
+    from sessions import CLOSED
+
+
+def parse_timeframe(timeframe):
+    # 解析周期：分钟数（3、'45'、'45m'）、天数（'2d'）或 'day'/'week'/'month'/'year'
+    # 返回 ('minute', 分钟数)、('day', 天数) 或 ('calendar', 周期)
+    timeframe = str(timeframe).strip().lower()
+    if timeframe in ('week', 'month', 'year'):
+        return 'calendar', timeframe
+    if timeframe == 'day':
+        return 'day', 1
+    match = re.fullmatch(r'(\d+)\s*(m|min|h|d)?', timeframe)
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"不支持的周期: {timeframe}")
+    count, unit = int(match.group(1)), match.group(2) or 'm'
+    if unit == 'd':
+        return 'day', count
+    count = count * 60 if unit == 'h' else count
+    if count > 24 * 60:
+        raise ValueError(f"超过一天的周期请使用天数，如 '2d': {timeframe}")
+    return 'minute', count
+
+
+def bucket_minutes(ctm, m, offset, profile=None):
+    # 分钟 K线的 ctm 数组映射到 m 分钟周期的开始时间，有交易时段表时按交易分钟对齐
+    # 休市时间返回 CLOSED
+    wall = ctm + offset
+    if profile is None:
+        day_start = wall - wall % DAY
+        step = m * MINUTE
+        return day_start + (wall - day_start) // step * step - offset
+    day = wall // DAY
+    week_start = (day - (day + 3) % 7) * DAY
+    table = np.frombuffer(profile.table(m), dtype=np.int32)
+    values = table[(wall - week_start) // MINUTE].astype(np.int64)
+    return np.where(values == CLOSED, CLOSED, week_start + values * MINUTE - offset)
+
+
+def trading_days(ctm, offset):
+    # 日 K线按交易日（周一到周五）连续编号
+    day = (ctm + offset) // DAY
+    weekday = (day + 3) % 7
+    return (day - weekday) // 7 * 5 + np.minimum(weekday, 5)
+
+
+def bucket_days(ctm, n, offset):
+    # 每 n 个交易日一组，组号相同即同一根 K线
+    return trading_days(ctm, offset) // n
+
+
+# 向前补读源数据时每种周期最多需要的秒数
+LOOKBACK = {'week': 7 * DAY, 'month': 31 * DAY, 'year': 366 * DAY}
+
+
+def lookback(timeframe):
+    # 第一根 K线的开始时间最多比第一条源 K线早多少秒
+    kind, value = parse_timeframe(timeframe)
+    if kind == 'minute':
+        return value * MINUTE
+    if kind == 'day':
+        return (value // 5 + 1) * 7 * DAY
+    return LOOKBACK[value]
+
+
+def aggregate(arrays, buckets, stamps=None):
+    # 按分组合并升序的 K线列数组，成交量取最后一条（与 merge_kline 一致）
+    # 新 K线的 ctm 取 stamps（默认为组内第一条的 ctm）
+    keep = buckets != CLOSED
+    arrays = {field: values[keep] for field, values in arrays.items()}
+    buckets = buckets[keep]
+    stamps = arrays['ctm'] if stamps is None else stamps[keep]
+    if not len(buckets):
+        return {field: values[:0] for field, values in arrays.items()}
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return {
+        'ctm': stamps[starts],
+        'open': arrays['open'][starts],
+        'high': np.maximum.reduceat(arrays['high'], starts),
+        'low': np.minimum.reduceat(arrays['low'], starts),
+        'close': arrays['close'][ends],
+        'volume': arrays['volume'][ends],
+    }
+
+
+def resample(arrays, timeframe, offset, profile=None, bucketer=None, partial=False):
+    # 把升序的源 K线列数组重采样为 timeframe 周期，分钟周期的源为 1 分钟 K线，其余为日 K线
+    # 源数据的第一条不是所在周期的开始时，第一根 K线缺少前面的数据，partial=False 时去掉
+    require_numpy()
+    kind, value = parse_timeframe(timeframe)
+    ctm = arrays['ctm']
+    if kind == 'minute':
+        buckets = bucket_minutes(ctm, value, offset, profile)
+    elif kind == 'day':
+        buckets = bucket_days(ctm, value, offset)
+    else:
+        buckets = np.array(bucketer.bucket_many(value, ctm.tolist()), dtype=np.int64)
+    result = aggregate(arrays, buckets, None if kind == 'day' else buckets)
+    if partial or not len(result['ctm']):
+        return result
+    first = ctm[buckets != CLOSED][0]
+    if kind == 'day':
+        complete = trading_days(first, offset) % value == 0
+    else:
+        complete = result['ctm'][0] == first
+    return result if complete else {field: values[1:] for field, values in result.items()}
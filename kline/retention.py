@@ -0,0 +1,89 @@
+import json
+
+# 各周期建议保留条数：分钟线保留约一到两个交易日，日线以上保留多年
+RETENTION_PRESET = {
+    '1分钟': 300,
+    '5分钟': 300,
+    '10分钟': 300,
+    '15分钟': 400,
+    '30分钟': 400,
+    '1小时': 500,
+    '2小时': 500,
+    '4小时': 500,
+    '日K': 1500,
+    '周K': 1000,
+    '月K': 500,
+    '年K': 100,
+}
+
+# Redis 列表每个元素的额外开销估计（quicklist 节点、长度编码等），有序集合每个成员的开销估计
+LIST_ENTRY_OVERHEAD = 16
+ZSET_ENTRY_OVERHEAD = 64
+
+
+def estimate_bytes(bars, sample_size, indexed=False):
+    # 按样本 K线的编码长度估计一个 K线列表（及其时间索引）占用的字节数
+    per_bar = sample_size + LIST_ENTRY_OVERHEAD
+    if indexed:
+        per_bar += sample_size + ZSET_ENTRY_OVERHEAD
+    return bars * per_bar
+
+
+class RetentionPolicy:
+    def __init__(self, default=500, cycles=None, exchanges=None, futures=None, budget=None, floor=50):
+        # 每个 (合约, 周期) 在 Redis 中保留的 K线条数
+        # cycles: {周期名: 条数}，exchanges: {交易所: {周期名: 条数}}，按交易所的设置优先
+        # futures: futures.json 的内容，用于查合约所属交易所
+        # budget: 所有 K线列表的内存预算（字节），超出时 fit 按比例缩小各周期条数，但不低于 floor
+        self.default = default
+        self.cycles = dict(cycles or {})
+        self.exchanges = {exchange: dict(limits) for exchange, limits in (exchanges or {}).items()}
+        self.symbols = {item['symbol']: item['exchange'] for item in futures or []}
+        self.budget = budget
+        self.floor = floor
+        self.scale = 1.0
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(futures=json.load(file), **kwargs)
+
+    def base_limit(self, code, cycle):
+        # 不考虑内存预算时的保留条数
+        limits = self.exchanges.get(self.symbols.get(code))
+        if limits and cycle in limits:
+            return limits[cycle]
+        return self.cycles.get(cycle, self.default)
+
+    def limit(self, code, cycle, scale=None):
+        # 当前生效的保留条数
+        base = self.base_limit(code, cycle)
+        scale = self.scale if scale is None else scale
+        if scale >= 1 or base <= self.floor:
+            return base
+        return max(self.floor, int(base * scale))
+
+    def projected(self, report, scale):
+        # 按 scale 裁剪后的预计总字节数
+        total = 0
+        for (code, cycle), item in report.items():
+            if item['bars']:
+                per_bar = item['bytes'] / item['bars']
+                total += min(item['bars'], self.limit(code, cycle, scale)) * per_bar
+        return total
+
+    def fit(self, report):
+        # 根据内存报告重新计算缩放比例，使预计总字节数不超过预算，返回新的比例
+        # 每次从 1 开始二分查找，合约减少后比例会恢复
+        if not self.budget or self.projected(report, 1.0) <= self.budget:
+            self.scale = 1.0
+            return self.scale
+        low, high = 0.0, 1.0
+        for _ in range(20):
+            middle = (low + high) / 2
+            if self.projected(report, middle) <= self.budget:
+                low = middle
+            else:
+                high = middle
+        self.scale = low
+        return self.scale
@@ -0,0 +1,170 @@
+import json
+import re
+from array import array
+
+try:
+    from .bucketing import DAY, MINUTE, Bucketer
+except ImportError:
+    from bucketing import DAY, MINUTE, Bucketer
+
+WEEK_MINUTES = 7 * 24 * 60
+CLOSED = -2 ** 31
+
+# 日盘交易时段（当天分钟数，左闭右开）
+DAY_SESSIONS = {
+    'default': ((9 * 60, 10 * 60 + 15), (10 * 60 + 30, 11 * 60 + 30), (13 * 60 + 30, 15 * 60)),
+    'cffex': ((9 * 60 + 30, 11 * 60 + 30), (13 * 60, 15 * 60)),
+    'cffex_bond': ((9 * 60 + 30, 11 * 60 + 30), (13 * 60, 15 * 60 + 15)),
+}
+CFFEX_BONDS = {'T', 'TF', 'TS', 'TL'}
+
+# 夜盘交易时段（前一交易日晚上，跨零点的结束时间大于 24 * 60），未列出的品种没有夜盘
+NIGHT_2300 = (21 * 60, 23 * 60)
+NIGHT_0100 = (21 * 60, 25 * 60)
+NIGHT_0230 = (21 * 60, 26 * 60 + 30)
+NIGHT_SESSIONS = {
+    'shfe': {
+        'AU': NIGHT_0230, 'AG': NIGHT_0230,
+        'CU': NIGHT_0100, 'AL': NIGHT_0100, 'ZN': NIGHT_0100, 'PB': NIGHT_0100,
+        'NI': NIGHT_0100, 'SN': NIGHT_0100, 'SS': NIGHT_0100, 'AO': NIGHT_0100,
+        'RB': NIGHT_2300, 'HC': NIGHT_2300, 'FU': NIGHT_2300, 'BU': NIGHT_2300,
+        'RU': NIGHT_2300, 'SP': NIGHT_2300, 'BR': NIGHT_2300,
+    },
+    'ine': {
+        'SC': NIGHT_0230, 'BC': NIGHT_0100, 'LU': NIGHT_2300, 'NR': NIGHT_2300,
+    },
+    'dce': {code: NIGHT_2300 for code in (
+        'A', 'B', 'C', 'CS', 'EB', 'EG', 'I', 'J', 'JM', 'L', 'M', 'P', 'PG', 'PP', 'RR', 'V', 'Y')},
+    'czce': {code: NIGHT_2300 for code in (
+        'CF', 'CY', 'FG', 'MA', 'OI', 'PF', 'PR', 'PX', 'RM', 'SA', 'SH', 'SR', 'TA', 'ZC')},
+}
+
+
+def get_product(symbol):
+    # 合约代码的品种部分，如 TA2501 -> TA
+    match = re.match('[A-Za-z]+', symbol)
+    return match.group().upper() if match else symbol.upper()
+
+
+class SessionProfile:
+    def __init__(self, day_sessions, night_session, cycles):
+        # 预先计算一周内每一分钟所属的各周期 K线开始分钟，休市为 CLOSED
+        # 分钟周期按交易分钟计数对齐交易日开盘，夜盘归属下一个交易日
+        self.day_sessions = day_sessions
+        self.night_session = night_session
+        self.trading_day = array('i', [CLOSED]) * WEEK_MINUTES
+        self.trading_days = []  # [(交易日零点的周内分钟, 该交易日按顺序的开市分钟)]
+        self.ends = []
+
+        # 0-4 为周一到周五，7 为下周一（用于填充周五夜盘）
+        for day in (0, 1, 2, 3, 4, 7):
+            prev = day - 3 if day % 7 == 0 else day - 1
+            sessions = []
+            if night_session:
+                sessions.append((prev * 1440 + night_session[0], prev * 1440 + night_session[1]))
+            sessions.extend((day * 1440 + start, day * 1440 + end) for start, end in day_sessions)
+            opens = [w for start, end in sessions for w in range(start, end)]
+            for w in opens:
+                if 0 <= w < WEEK_MINUTES:
+                    self.trading_day[w] = day * 1440
+            self.trading_days.append((day * 1440, opens))
+            self.ends.extend(end for _, end in sessions)
+        self.close_minutes(self.trading_day)
+
+        self.tables = {}
+        for m in cycles.values():
+            if isinstance(m, int):
+                self.table(m)
+
+    def close_minutes(self, table):
+        # 收盘那一分钟的报价并入最后一根 K线
+        for end in self.ends:
+            if 0 < end < WEEK_MINUTES and table[end] == CLOSED:
+                table[end] = table[end - 1]
+
+    def table(self, m):
+        # m 分钟周期的分桶表，不在 cycles 中的周期第一次使用时生成
+        if m not in self.tables:
+            table = array('i', [CLOSED]) * WEEK_MINUTES
+            for _, opens in self.trading_days:
+                for idx, w in enumerate(opens):
+                    if 0 <= w < WEEK_MINUTES:
+                        table[w] = opens[idx // m * m]
+            self.close_minutes(table)
+            self.tables[m] = table
+        return self.tables[m]
+
+
+class SessionCalendar:
+    def __init__(self, futures, cycles, offset=None):
+        # 按 futures.json 中的 exchange 字段和品种生成交易时段表，相同时段的品种共用一张表
+        self.cycles = cycles
+        self.bucketer = Bucketer(cycles, offset)
+        self.offset = self.bucketer.offset
+        self.profiles = {}
+        self.symbols = {}
+        for item in futures:
+            exchange = item['exchange']
+            product = get_product(item['symbol'])
+            if exchange == 'cffex':
+                day_sessions = DAY_SESSIONS['cffex_bond' if product in CFFEX_BONDS else 'cffex']
+            else:
+                day_sessions = DAY_SESSIONS['default']
+            night_session = NIGHT_SESSIONS.get(exchange, {}).get(product)
+            key = (day_sessions, night_session)
+            if key not in self.profiles:
+                self.profiles[key] = SessionProfile(day_sessions, night_session, cycles)
+            self.symbols[item['symbol']] = self.profiles[key]
+
+    @classmethod
+    def from_file(cls, path, cycles, offset=None):
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(json.load(file), cycles, offset)
+
+    def knows(self, code):
+        return code in self.symbols
+
+    def locate(self, ts):
+        # 返回 (本周一零点的本地秒数, 本周第几分钟)
+        wall = int(ts) + self.offset
+        day = wall // DAY
+        week_start = (day - (day + 3) % 7) * DAY
+        return week_start, (wall - week_start) // MINUTE
+
+    def is_open(self, code, ts):
+        profile = self.symbols.get(code)
+        if not profile:
+            return True
+        return profile.trading_day[self.locate(ts)[1]] != CLOSED
+
+    def any_open(self, ts):
+        # 任一品种处于交易时段，用于轮询时跳过全市场休市的时间
+        w = self.locate(ts)[1]
+        return any(profile.trading_day[w] != CLOSED for profile in self.profiles.values())
+
+    def bucket(self, code, m, ts):
+        # 按交易时段分桶，休市时间返回 None
+        profile = self.symbols[code]
+        week_start, w = self.locate(ts)
+        if isinstance(m, int):
+            value = profile.table(m)[w]
+        else:
+            value = profile.trading_day[w]
+            if m != 'day':
+                # 周、月、年按交易日所在日期划分，休市时间按自然日
+                ts = int(ts) if value == CLOSED else week_start + value * MINUTE - self.offset
+                return self.bucketer.bucket(m, ts)
+        if value == CLOSED:
+            return None
+        return week_start + value * MINUTE - self.offset
+
+    def bucket_all(self, code, ts):
+        # 一次计算所有周期，返回 [(周期名, ctm, ctmfmt)]，休市时间返回空列表
+        if not self.is_open(code, ts):
+            return []
+        result = []
+        for cycle, m in self.cycles.items():
+            ctm = self.bucket(code, m, ts)
+            if ctm is not None:
+                result.append((cycle, ctm, self.bucketer.format(m, ctm)))
+        return result
@@ -0,0 +1,149 @@
+import gzip
+import os
+import struct
+import sys
+import time
+
+try:
+    from .codec import decode_kline
+except ImportError:
+    from codec import decode_kline
+
+# 快照文件：gzip 压缩的记录流，文件头为 MAGIC
+# 每条记录：类型(1 字节，H 为哈希，L 为列表) + 键长度(u16) + 键 + 元素数(u32) + 各元素长度(u32 数组) + 元素内容
+# 哈希的元素依次为 field、value
+MAGIC = b'KSNAP1\n'
+RECORD_HEAD = struct.Struct('<cHI')
+BATCH_KEYS = 500
+
+
+class KlineSnapshot:
+    def __init__(self, ks, compresslevel=1):
+        # 把报价哈希和 K线列表整体导出到一个本地文件，重启或清空 Redis 后一次性导入
+        # 读写都使用不解码的连接，紧凑编码的 K线原样保存
+        self.ks = ks
+        self.client = ks.raw_redis
+        self.compresslevel = compresslevel
+
+    def find_prexes(self):
+        # 以 {prex}_ticket 哈希发现所有前缀
+        return sorted({key.decode()[:-len('_ticket')] for key in self.client.scan_iter(match='*_ticket', count=1000)})
+
+    def find_keys(self, prex):
+        # 返回 [(类型, 键)]，导出报价哈希、K线列表和指标列表，版本号等哈希在导入时重新生成
+        keys = [key for pattern in (f"{prex}_kline_*", f"{prex}_indicator_*")
+                for key in self.client.scan_iter(match=pattern, count=1000)]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+        result = [(b'H', f"{prex}_ticket".encode())] if self.client.exists(f"{prex}_ticket") else []
+        result.extend((b'L', key) for key, kind in zip(keys, pipe.execute()) if kind == b'list')
+        return result
+
+    def write_record(self, file, kind, key, items):
+        file.write(RECORD_HEAD.pack(kind, len(key), len(items)))
+        file.write(key)
+        file.write(struct.pack(f'<{len(items)}I', *map(len, items)))
+        file.write(b''.join(items))
+
+    def dump(self, path, prexes=None):
+        # 导出快照，返回 {'keys', 'items', 'bytes', 'seconds'}
+        start = time.perf_counter()
+        prexes = prexes or self.find_prexes()
+        keys = [item for prex in prexes for item in self.find_keys(prex)]
+        stats = {'keys': 0, 'items': 0}
+        with gzip.open(path + '.tmp', 'wb', compresslevel=self.compresslevel) as file:
+            file.write(MAGIC)
+            for offset in range(0, len(keys), BATCH_KEYS):
+                batch = keys[offset:offset + BATCH_KEYS]
+                pipe = self.client.pipeline(transaction=False)
+                for kind, key in batch:
+                    if kind == b'H':
+                        pipe.hgetall(key)
+                    else:
+                        pipe.lrange(key, 0, -1)
+                for (kind, key), data in zip(batch, pipe.execute()):
+                    items = [x for pair in data.items() for x in pair] if kind == b'H' else data
+                    if items:
+                        self.write_record(file, kind, key, items)
+                        stats['keys'] += 1
+                        stats['items'] += len(items) // 2 if kind == b'H' else len(items)
+        os.replace(path + '.tmp', path)
+        stats['bytes'] = os.path.getsize(path)
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+    def read(self, path):
+        # 逐条读取快照记录 (类型, 键, 元素列表)
+        with gzip.open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"不是 K线快照文件: {path}")
+            while True:
+                head = file.read(RECORD_HEAD.size)
+                if not head:
+                    return
+                kind, key_size, count = RECORD_HEAD.unpack(head)
+                key = file.read(key_size)
+                sizes = struct.unpack(f'<{count}I', file.read(4 * count))
+                data = memoryview(file.read(sum(sizes)))
+                items = []
+                position = 0
+                for size in sizes:
+                    items.append(bytes(data[position:position + size]))
+                    position += size
+                yield kind, key, items
+
+    def restore(self, path, batch_keys=BATCH_KEYS):
+        # 用非事务流水线批量导入快照，同名键整体替换，返回 {'keys', 'items', 'seconds'}
+        # K线列表导入后增加 epoch 使读缓存失效，indexed 时重建时间索引
+        start = time.perf_counter()
+        ks = self.ks
+        stats = {'keys': 0, 'items': 0}
+        pipe = self.client.pipeline(transaction=False)
+        pending = 0
+        for kind, key, items in self.read(path):
+            key = key.decode()
+            pipe.delete(key)
+            if kind == b'H':
+                pipe.hset(key, mapping=dict(zip(items[::2], items[1::2])))
+                stats['items'] += len(items) // 2
+            else:
+                pipe.rpush(key, *items)
+                stats['items'] += len(items)
+                prex, found, rest = key.partition('_kline_')
+                if found:
+                    ks.bump_kline_version(key, prex, replaced=True, client=pipe)
+                if found and ks.indexed:
+                    index_key = f"{prex}_kindex_{rest}"
+                    pipe.delete(index_key)
+                    pipe.zadd(index_key, {item: int(decode_kline(item)['ctm']) for item in items})
+            stats['keys'] += 1
+            pending += 1
+            if pending >= batch_keys:
+                pipe.execute()
+                pending = 0
+        pipe.execute()
+
+        # 进程内缓存和指标状态都以导入前的数据为准，全部清空
+        ks.kline_cache.clear()
+        ks.resample_cache.clear()
+        ks.reset_ticket_cache()
+        ks.ticket_decoded.clear()
+        if ks.indicators:
+            ks.indicators.reset()
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+
+if __name__ == '__main__':
+    # 用法: python snapshot.py dump|restore 文件 [prex ...]，需要本地 Redis
+    from kliner import KlineService
+
+    command, path, prexes = sys.argv[1], sys.argv[2], sys.argv[3:]
+    snapshot = KlineSnapshot(KlineService())
+    if command == 'dump':
+        print(snapshot.dump(path, prexes or None))
+    elif command == 'restore':
+        print(snapshot.restore(path))
+    else:
+        raise SystemExit(f"未知命令: {command}")
@@ -1,59 +1,22 @@
 import json
 import os
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import timedelta, datetime
+from datetime import timedelta
 from decimal import Decimal
 
-import requests
-
+from backfill import BackfillPipeline
+from fetchqueue import KlineFetchWorkers, KlineRequestQueue
 from kliner import KlineService
+from poller import QuotePoller
+from retention import RetentionPolicy
+from sessions import SessionCalendar
+from upstream import KLINE_MINUTES, fetch_kline
 
 def get_kline_by_minutes(symbol, minutes):
     if minutes not in "1,10,15,30,45,60":
         return {"error":"仅支持分钟1,10,15,30,45,60"}
-    headers = {
-        "Accept": "*/*",
-        "Accept-Language": "zh-CN,zh;q=0.9",
-        "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "Pragma": "no-cache",
-        "Referer": f"https://finance.sina.com.cn/futures/quotes/{symbol}.shtml",
-        "Sec-Fetch-Dest": "script",
-        "Sec-Fetch-Mode": "no-cors",
-        "Sec-Fetch-Site": "same-site",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
-        "sec-ch-ua": "\"Chromium\";v=\"128\", \"Not;A=Brand\";v=\"24\", \"Google Chrome\";v=\"128\"",
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": "\"Windows\""
-    }
-    url = f"https://stock2.finance.sina.com.cn/futures/api/jsonp.php/var%20_{symbol}_{minutes}_{time.time() * 1000}=/InnerFuturesNewService.getFewMinLine"
-    params = {
-        "symbol": symbol,
-        "type": minutes
-    }
-    response = requests.get(url, headers=headers, params=params)
-    try:
-        unclean_data = re.findall("\((.*)\)", response.text)[0]
-        return_data = []
-        for item in json.loads(unclean_data):
-            date_time_obj = datetime.strptime(item["d"], '%Y-%m-%d %H:%M:%S')
-            # 将datetime对象转换为十位数时间戳
-            timestamp = int(date_time_obj.timestamp())
-            return_data.append({
-                "open": float(item["o"]),
-                "close": item["c"],
-                "high": item["h"],
-                "low": item["l"],
-                "ctm": str(timestamp),
-                'ctmfmt': datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
-                "volume": item["v"],
-                'wave': 0
-            })
-        return return_data
-    except:
-        return None
+    # 复用共享连接池，不再为每次请求新建 TCP+TLS 连接
+    return fetch_kline(symbol, minutes)
 
 
 # 获取所有期货的名称
@@ -75,53 +38,37 @@ def fetch_single_kline_data(kline_type,future_code, ks):
         # 获取该期货的1分钟K线信息
         kline_info = get_kline_by_minutes(symbol=future_code, minutes=kline_type)
         # 使用KlineService存储K线信息
-        ks.save_klines(klines=kline_info, prex='tf_futures_trade', cycle=kline_type, code=future_code)
+        ks.save_klines(klines=kline_info, prex='tf_futures_trade', cycle=kline_type, code=future_code, merge=True)
         print(f"{future_code} 数据已保存")
     except Exception as e:
         print(f"获取 {future_code} 数据失败: {e}")
 
 
 # 并发获取所有期货的K线数据1
-def fetch_all_kline_data(ks):
-    futures_list_pre = get_all_futures()
-    futures_list = []
-    for future in futures_list_pre:
-        futures_list.append(future['symbol'])
-    # 使用ThreadPoolExecutor进行并发请求
-    with ThreadPoolExecutor(max_workers=800) as executor:
-        future_to_code = {executor.submit(fetch_single_kline_data, future_code, ks): future_code for future_code in futures_list}
+def fetch_all_kline_data(ks, kline_types=KLINE_MINUTES, concurrency=32, rate=50):
+    # 有界异步流水线：最多 concurrency 个并发请求，每秒不超过 rate 个，K线列表按批写入 Redis
+    futures_list = [future['symbol'] for future in get_all_futures()]
+    pipeline = BackfillPipeline(ks, prex='tf_futures_trade', concurrency=concurrency, rate=rate)
+    metrics = pipeline.run([(future_code, kline_type) for future_code in futures_list for kline_type in kline_types])
+    for future_code, kline_type, error in metrics['failures']:
+        print(f'{future_code} {kline_type} 生成时出现异常: {error}')
+    return metrics
+
+
+_poller = None
 
-        for future in as_completed(future_to_code):
-            future_code = future_to_code[future]
-            try:
-                future.result()
-            except Exception as exc:
-                print(f'{future_code} 生成时出现异常: {exc}')
+
+def get_poller():
+    # 全市场报价按分片并发轮询，合约列表只读取一次
+    global _poller
+    if _poller is None:
+        _poller = QuotePoller([item["symbol"] for item in get_all_futures()], shard_size=100, workers=8)
+    return _poller
 
 
 def get_futures_prices():
-    headers = {
-        "Accept": "*/*",
-        "Accept-Language": "zh-CN,zh;q=0.9",
-        "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "Pragma": "no-cache",
-        "Referer": "https://finance.sina.com.cn/futuremarket/",
-        "Sec-Fetch-Dest": "script",
-        "Sec-Fetch-Mode": "no-cors",
-        "Sec-Fetch-Site": "cross-site",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
-        "sec-ch-ua": "\"Google Chrome\";v=\"129\", \"Not=A?Brand\";v=\"8\", \"Chromium\";v=\"129\"",
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": "\"Windows\""
-    }
-    futures = get_all_futures()
-    futures_list_str = ""
-    for item in futures:
-        futures_list_str = futures_list_str + "nf_" + item["symbol"] + ","
-    url = f"https://hq.sinajs.cn/rn={time.time() * 1000}&list={futures_list_str}"
-    response = requests.get(url, headers=headers)
-    return response.text
+    # 各分片响应原文按完成顺序拼接，失败的分片跳过
+    return "\n".join(text for _, text in get_poller().fetch() if text)
 
 
 def convert_timedelta_to_serializable(data):
@@ -179,47 +126,10 @@ def get_all_ticket():
     # 返回顺序（中金 指数期货,国债期货） 0.开盘价     1.最高价      2.最低价    3.最新价     4.成交量   5.不知道        6.持仓量      7.最新价   8.不知道   9.不知道    10.不知道   11.       12.
     #                               ['3197.400', '3197.400', '3173.000', '3185.000', '28818', '91807601.000', '18462.000', '3185.000', '0.000', '3838.400', '2559.200', '0.000', '0.000', '3198.400', '3198.800', '40295.000', '3185.000', '156', '0.000', '0', '0.000', '0', '0.000', '0', '0.000', '0', '3185.200', '88', '0.000', '0', '0.000', '0', '0.000', '0', '0.000', '0', '2024-09-20', '15:00:00', '400', '0', '', '', '', '', '', '', '', '', '3185.773', '沪深300指数期货2409']
     '''
-    unclean_futures = get_futures_prices()
-    all_futures = get_all_futures()
-    # mysqlconn = mysql_conn()
-    return_data = []
-    for i in range(len(all_futures)):
-        clean_futures = unclean_futures.split("\nvar")[i].split('"')[1].split(",")
-
-
-        try:
-            timer_date = unclean_futures.split("\nvar")[i].split('"')[1].split(",,,,,,,,,")[0].split(",")[-2]
-            timer_time = clean_futures[1]
-            fmt_time = f"{timer_date} {timer_time[0:2]}:{timer_time[2:4]}:{timer_time[4:6]}"
-            date_time = datetime.strptime(fmt_time, "%Y-%m-%d %H:%M:%S")
-            timestamp = int(time.mktime(date_time.timetuple()))
-            # tickets = convert_timedelta_to_serializable(convert_decimal_to_float(mysqlconn.get_single_symbol_info(all_futures[i]["symbol"])))
-            return_pre_data = {
-                "ask": float(clean_futures[6]),
-                "asm": float(clean_futures[12]),
-                "bid": float(clean_futures[7]),
-                "bim": float(clean_futures[11]),
-                "open": float(clean_futures[2]),
-                "close": float(clean_futures[10]),
-                "nv": float(clean_futures[14]),
-                "high": float(clean_futures[3]),
-                "low": float(clean_futures[4]),
-                "wave": float(str(round(((float(clean_futures[8]) - float(clean_futures[10])) / float(clean_futures[10])) * 100, 2))),
-                "price": float(clean_futures[8]),
-                "volume": float(clean_futures[14]),
-                "position": float(clean_futures[9]),
-                "digit": 4,
-                "code": all_futures[i]["symbol"],
-                "code2": all_futures[i]["symbol"],
-                "ctm": f"{timestamp}",
-                "ctmfmt": fmt_time
-            }
-            # tickets["ticket"] = return_pre_data
-            return_data.append(return_pre_data)
-        except:
-            # print(unclean_futures.split("\nvar")[i])
-            pass
-
+    # 分片并发请求，每个分片返回后单次扫描解析，按合约名对应，格式错误的行和失败的分片汇总输出
+    return_data, errors = get_poller().poll()
+    if errors:
+        print(f"{len(errors)} 个合约报价无法解析，例如: {errors[:3]}")
     return return_data
 
 
@@ -269,36 +179,52 @@ $ticket['ask'] = $symbol['B1'];
 def fetch_all_ticket_data(ks):
     try:
         all_tickets = get_all_ticket()
-        # 使用KlineService存储K线信息
-        for ticket in all_tickets:
-            try:
-                # , prex='tf_futures_trade'
-                ks.save_ticket(ticket=ticket, prex="tf_futures_trade")
-
-            except Exception as e:
-                print(f"保存ticket 数据失败: {e}")
-        print(f"所有ticket 数据已保存")
+        # 使用KlineService批量存储ticket信息
+        count = ks.save_tickets(all_tickets, prex="tf_futures_trade")
+        print(f"所有ticket 数据已保存: {count}")
     except Exception as e:
         print(f"保存ticket 数据失败: {e}")
 
 
-def save_kline_data_by_redis(prex='tf_futures_trade', ks=None):
-    keys = ks.match_search_keys()
-    for key in keys:
-        print(key)
-        try:
-            kline_type = key.split("_")[3]
-        except:
-            return {"error":"该redis数据的键名不符合规范"}
-        try:
-            future_code = key.split("_")[2]
+def start_kline_workers(ks, prex='tf_futures_trade', workers=8):
+    # 按需 K线请求提交到 Redis 队列（KlineRequestQueue.submit/request，协议见 fetchqueue.py），由工作线程阻塞取出处理
+    queue = KlineRequestQueue(ks.redis)
+    migrate_search_keys(ks, queue)
+    fetch_workers = KlineFetchWorkers(ks, queue, prex=prex, workers=workers)
+    fetch_workers.start()
+    return fetch_workers
+
+
+# 旧的 is_search_{code}_{cycle} 键的转换间隔（秒），兼容还没有改用队列提交的程序
+SEARCH_KEY_INTERVAL = 10
+
+
+def migrate_search_keys(ks, queue):
+    try:
+        count = queue.migrate_search_keys(ks)
+        if count:
+            print(f"已转换 {count} 个 is_search 请求，请改用 kline_fetch 队列提交")
+    except Exception as e:
+        print(f"转换 is_search 请求失败: {e}")
+
+
+# 按保留策略和内存预算裁剪 K线列表的间隔（秒），预算由环境变量 KLINE_MEMORY_BUDGET_MB 设置，不设置时只按条数裁剪
+RETENTION_INTERVAL = 300
+
+
+def get_retention_policy():
+    budget = os.environ.get("KLINE_MEMORY_BUDGET_MB")
+    return RetentionPolicy(futures=get_all_futures(), budget=int(float(budget) * 1024 * 1024) if budget else None)
 
-            fetch_single_kline_data(kline_type=kline_type,future_code=future_code, ks=ks)
 
-        except Exception as e:
-            print(f"保存kline 数据失败: {e}")
-        print(f"保存kline 数据成功")
-        time.sleep(1)
+def enforce_kline_retention(ks, prex='tf_futures_trade'):
+    try:
+        report = ks.enforce_retention(prex)
+        size = sum(item['bytes'] for item in report.values()) / 1024 / 1024
+        print(f"K线保留策略: {len(report)} 个列表，约 {size:.1f}MB，缩放比例 {ks.retention.scale:.2f}")
+    except Exception as e:
+        print(f"K线裁剪失败: {e}")
+
 
 def write_ready_data(ks):
 
@@ -10542,18 +10468,30 @@ def write_ready_data(ks):
 
 
 if __name__ == '__main__':
-    ks = KlineService()
+    ks = KlineService(retention=get_retention_policy())
+    calendar = SessionCalendar(get_all_futures(), ks.cycles)
     # print(get_all_ticket())
+    fetch_workers = start_kline_workers(ks, prex='tf_futures_trade')
+    last_retention = 0
+    last_search = time.monotonic()
     try:
         while True:
-            save_kline_data_by_redis(prex='tf_futures_trade', ks=ks)
-            fetch_all_ticket_data(ks)
+            # 所有品种都休市时跳过报价轮询
+            if calendar.any_open(time.time()):
+                fetch_all_ticket_data(ks)
+            if time.monotonic() - last_retention >= RETENTION_INTERVAL:
+                enforce_kline_retention(ks)
+                last_retention = time.monotonic()
+            if time.monotonic() - last_search >= SEARCH_KEY_INTERVAL:
+                migrate_search_keys(ks, fetch_workers.queue)
+                last_search = time.monotonic()
             time.sleep(1)
             print("正在更新数据...", time.time())
             # 设置更新间隔，这里是1秒
         # write_ready_data(ks)
         # print("初始数据写入完成")
     except KeyboardInterrupt:
+        fetch_workers.stop()
         print("程序终止")
 #----------------------------------------------------------
 #     ready_data_5m = [
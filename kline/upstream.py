@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# 新浪行情接口，host 可替换为本地替身服务器用于测试，环境变量 KLINE_HOST、QUOTE_HOST 可指向回放服务器（replay.py）
+KLINE_HOST = os.environ.get("KLINE_HOST", "https://stock2.finance.sina.com.cn")
+KLINE_PATH = "/futures/api/jsonp.php/var%20_{symbol}_{minutes}_{ts}=/InnerFuturesNewService.getFewMinLine"
+# getFewMinLine 支持的分钟周期
+KLINE_MINUTES = ('1', '10', '15', '30', '45', '60')
+QUOTE_HOST = os.environ.get("QUOTE_HOST", "https://hq.sinajs.cn")
+QUOTE_PATH = "/rn={ts}&list={symbols}"
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
+QUOTE_HEADERS = {
+    "Accept": "*/*",
+    "Accept-Language": "zh-CN,zh;q=0.9",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Pragma": "no-cache",
+    "Referer": "https://finance.sina.com.cn/futuremarket/",
+    "Sec-Fetch-Dest": "script",
+    "Sec-Fetch-Mode": "no-cors",
+    "Sec-Fetch-Site": "cross-site",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
+    "sec-ch-ua": "\"Google Chrome\";v=\"129\", \"Not=A?Brand\";v=\"8\", \"Chromium\";v=\"129\"",
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": "\"Windows\""
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def kline_headers(symbol):
+    return {
+        "Accept": "*/*",
+        "Accept-Language": "zh-CN,zh;q=0.9",
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "Pragma": "no-cache",
+        "Referer": f"https://finance.sina.com.cn/futures/quotes/{symbol}.shtml",
+        "Sec-Fetch-Dest": "script",
+        "Sec-Fetch-Mode": "no-cors",
+        "Sec-Fetch-Site": "same-site",
+        "User-Agent": USER_AGENT,
+        "sec-ch-ua": "\"Chromium\";v=\"128\", \"Not;A=Brand\";v=\"24\", \"Google Chrome\";v=\"128\"",
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": "\"Windows\""
+    }
+
+
+def kline_url(symbol, minutes, host=KLINE_HOST):
+    return host + KLINE_PATH.format(symbol=symbol, minutes=minutes, ts=time.time() * 1000)
+
+
+def quote_url(symbols, host=QUOTE_HOST):
+    return host + QUOTE_PATH.format(ts=time.time() * 1000, symbols="".join(f"nf_{symbol}," for symbol in symbols))
+
+
+def get_session(pool_size=64):
+    # 进程内共享的 requests.Session，连接保持复用，每个 host 最多保留 pool_size 个空闲连接
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def parse_kline(text):
+    # 解析分钟 K线 JSONP 响应，格式错误时返回 None
+    try:
+        unclean_data = re.findall(r"\((.*)\)", text)[0]
+        return_data = []
+        for item in json.loads(unclean_data):
+            date_time_obj = datetime.strptime(item["d"], '%Y-%m-%d %H:%M:%S')
+            # 将datetime对象转换为十位数时间戳
+            timestamp = int(date_time_obj.timestamp())
+            return_data.append({
+                "open": float(item["o"]),
+                "close": item["c"],
+                "high": item["h"],
+                "low": item["l"],
+                "ctm": str(timestamp),
+                'ctmfmt': datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+                "volume": item["v"],
+                'wave': 0
+            })
+        return return_data
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def fetch_kline(symbol, minutes, host=KLINE_HOST, timeout=10, session=None):
+    # 用共享连接池获取分钟 K线
+    session = session or get_session()
+    response = session.get(kline_url(symbol, minutes, host), headers=kline_headers(symbol),
+                           params={"symbol": symbol, "type": minutes}, timeout=timeout)
+    return parse_kline(response.text)
+
+
+def fetch_quotes(symbols, host=QUOTE_HOST, timeout=10, session=None):
+    # 用共享连接池获取一批合约的实时报价原文
+    session = session or get_session()
+    return session.get(quote_url(symbols, host), headers=QUOTE_HEADERS, timeout=timeout).text
+
+
+class AsyncFetcher:
+    def __init__(self, limit=64, limit_per_host=16, timeout=10, recorder=None):
+        # 基于 aiohttp 的异步客户端，连接池总数不超过 limit，同一 host 的并发连接不超过 limit_per_host
+        # 超出限制的请求在连接池中排队，用法: async with AsyncFetcher() as fetcher: ...
+        # recorder 为 replay.Recorder 时录制所有响应原文
+        if aiohttp is None:
+            raise ImportError("异步获取需要安装 aiohttp")
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.recorder = recorder
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.session = None
+
+    async def get_text(self, url, headers=None, params=None):
+        async with self.session.get(url, headers=headers, params=params) as response:
+            if self.recorder is not None:
+                self.recorder.record_http(str(response.url), response.status, await response.read(),
+                                          response.headers.get('Content-Type'))
+            return await response.text(errors='replace')
+
+    async def fetch_kline(self, symbol, minutes, host=KLINE_HOST):
+        text = await self.get_text(kline_url(symbol, minutes, host), kline_headers(symbol),
+                                   {"symbol": symbol, "type": minutes})
+        return parse_kline(text)
+
+    async def fetch_quotes(self, symbols, host=QUOTE_HOST):
+        return await self.get_text(quote_url(symbols, host), QUOTE_HEADERS)
+
+    async def fetch_klines(self, pairs, host=KLINE_HOST):
+        # 并发获取 [(symbol, minutes)]，返回与输入顺序相同的结果，失败的请求为异常对象
+        return await asyncio.gather(*[self.fetch_kline(symbol, minutes, host) for symbol, minutes in pairs],
+                                    return_exceptions=True)
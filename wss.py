@@ -16,11 +16,14 @@ def get_all_futures():
         return return_data
 
 
+ks = KlineService()
+
+
 def get_tickets(code=None):
-    # 获取所有期货其它信息
-    ks = KlineService()
-    tikcets = ks.load_ticket(code,prex="tf_futures_trade")
-    return tikcets
+    # 获取所有期货其它信息，返回解码后的报价
+    if code:
+        return ks.load_ticket(code, prex="tf_futures_trade")
+    return ks.load_tickets(prex="tf_futures_trade")
 
 
 async def send_data(websocket, path):